@@ -0,0 +1,50 @@
+-- Session duplication executed entirely in the database.
+-- Used by yourapp.sessions.duplicate_session and
+-- yourapp.sessions.messages.duplicate_all_session_messages_and_assign_to_new_session.
+
+create or replace function copy_session_messages(p_old_session_id bigint, p_new_session_id bigint)
+returns bigint
+language plpgsql
+as $$
+declare
+  v_count bigint;
+begin
+  insert into "sessions messages" (session_id, payload_json, is_system)
+  select p_new_session_id, payload_json, is_system
+  from "sessions messages"
+  where session_id = p_old_session_id
+  order by id;
+
+  get diagnostics v_count = row_count;
+  return v_count;
+end;
+$$;
+
+create or replace function duplicate_session(p_session_id bigint)
+returns table (new_session_id bigint, message_count bigint)
+language plpgsql
+as $$
+declare
+  v_new_session_id bigint;
+begin
+  insert into sessions (owner_id, title, system_state_json, user_state_json)
+  select
+    owner_id,
+    case
+      when title ~ ' [0-9]+$'
+        then regexp_replace(title, '[0-9]+$', '') || ((substring(title from '[0-9]+$'))::bigint + 1)::text
+      else title || ' 1'
+    end,
+    system_state_json,
+    user_state_json
+  from sessions
+  where id = p_session_id
+  returning id into v_new_session_id;
+
+  if v_new_session_id is null then
+    return;
+  end if;
+
+  return query select v_new_session_id, copy_session_messages(p_session_id, v_new_session_id);
+end;
+$$;
@@ -0,0 +1,43 @@
+-- Persist one tick of a chat loop in a single transaction.
+-- Used by yourapp.sessions.persistence.SessionWriter.
+--
+-- p_system_state_json and p_user_state_json are left untouched when null.
+-- p_messages is a json array of {"payload_json", "is_system", "created_at"}
+-- objects, inserted in array order.
+
+create or replace function persist_session_tick(
+  p_session_id bigint,
+  p_system_state_json json,
+  p_user_state_json json,
+  p_messages json
+)
+returns bigint
+language plpgsql
+as $$
+declare
+  v_count bigint;
+begin
+  update sessions
+  set
+    system_state_json = coalesce(p_system_state_json, system_state_json),
+    user_state_json = coalesce(p_user_state_json, user_state_json),
+    last_activity_at = now()
+  where id = p_session_id;
+
+  if not found then
+    raise exception 'session % not found', p_session_id;
+  end if;
+
+  insert into "sessions messages" (session_id, payload_json, is_system, created_at)
+  select
+    p_session_id,
+    message -> 'payload_json',
+    (message ->> 'is_system')::boolean,
+    coalesce((message ->> 'created_at')::timestamptz at time zone 'utc', now())
+  from json_array_elements(coalesce(p_messages, '[]'::json)) with ordinality as messages(message, position)
+  order by position;
+
+  get diagnostics v_count = row_count;
+  return v_count;
+end;
+$$;
@@ -0,0 +1,78 @@
+-- Persist one tick of a chat loop in a single transaction, states being
+-- written either whole or as patches of their top level keys.
+-- Used by yourapp.sessions.persistence.SessionWriter, replaces the function
+-- of 002_persist_session_tick.sql.
+--
+-- p_system_state_json and p_user_state_json, when not null, replace the state.
+-- Otherwise p_system_state_patch and p_user_state_patch, json objects as text,
+-- set their keys in the state and the p_*_removed keys are removed from it.
+-- States are left untouched when all their parameters are null.
+-- p_messages is a json array of {"payload_json", "is_system", "created_at"}
+-- objects, inserted in array order.
+
+drop function if exists persist_session_tick(bigint, json, json, json);
+
+-- the states columns hold json strings of the encoded states
+create or replace function patch_state_json(p_state json, p_patch text, p_removed text[])
+returns json
+language sql
+immutable
+as $$
+  select to_json(
+    (
+      ((p_state #>> '{}')::jsonb || coalesce(p_patch, '{}')::jsonb)
+      - coalesce(p_removed, '{}'::text[])
+    )::text
+  );
+$$;
+
+create or replace function persist_session_tick(
+  p_session_id bigint,
+  p_system_state_json json default null,
+  p_user_state_json json default null,
+  p_messages json default null,
+  p_system_state_patch text default null,
+  p_system_state_removed text[] default null,
+  p_user_state_patch text default null,
+  p_user_state_removed text[] default null
+)
+returns bigint
+language plpgsql
+as $$
+declare
+  v_count bigint;
+begin
+  update sessions
+  set
+    system_state_json = case
+      when p_system_state_json is not null then p_system_state_json
+      when p_system_state_patch is not null or p_system_state_removed is not null
+        then patch_state_json(system_state_json, p_system_state_patch, p_system_state_removed)
+      else system_state_json
+    end,
+    user_state_json = case
+      when p_user_state_json is not null then p_user_state_json
+      when p_user_state_patch is not null or p_user_state_removed is not null
+        then patch_state_json(user_state_json, p_user_state_patch, p_user_state_removed)
+      else user_state_json
+    end,
+    last_activity_at = now()
+  where id = p_session_id;
+
+  if not found then
+    raise exception 'session % not found', p_session_id;
+  end if;
+
+  insert into "sessions messages" (session_id, payload_json, is_system, created_at)
+  select
+    p_session_id,
+    message -> 'payload_json',
+    (message ->> 'is_system')::boolean,
+    coalesce((message ->> 'created_at')::timestamptz at time zone 'utc', now())
+  from json_array_elements(coalesce(p_messages, '[]'::json)) with ordinality as messages(message, position)
+  order by position;
+
+  get diagnostics v_count = row_count;
+  return v_count;
+end;
+$$;
@@ -0,0 +1,5 @@
+-- Lists of a user's sessions, most recently active first, paginated on
+-- (last_activity_at, id). Used by yourapp.sessions.get_session_summaries.
+
+create index if not exists sessions_owner_id_last_activity_at_id_idx
+  on sessions (owner_id, last_activity_at desc, id desc);
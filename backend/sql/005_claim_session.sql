@@ -0,0 +1,58 @@
+-- Claim a session for a chat in a single transaction: open it if it is closed,
+-- otherwise open a copy of it. Used by yourapp.sessions.claim_session.
+--
+-- Returns the opened session, with duplicated_from set to p_session_id when it
+-- is a copy, or no row when p_session_id is not a session of p_owner_id.
+-- Concurrent claims of a closed session are serialized by the row lock of the
+-- update: one of them opens it, the others get copies.
+
+create or replace function claim_session(p_session_id bigint, p_owner_id uuid)
+returns table (
+  id bigint,
+  owner_id uuid,
+  title character varying,
+  created_at timestamp,
+  last_activity_at timestamp,
+  system_state_json json,
+  user_state_json json,
+  is_open boolean,
+  duplicated_from bigint
+)
+language plpgsql
+as $$
+declare
+  v_session sessions;
+  v_new_session_id bigint;
+begin
+  update sessions s
+  set is_open = true
+  where s.id = p_session_id and s.owner_id = p_owner_id and not s.is_open
+  returning s.* into v_session;
+
+  if not found then
+    perform 1 from sessions s where s.id = p_session_id and s.owner_id = p_owner_id;
+    if not found then
+      return;
+    end if;
+
+    -- open already
+    select d.new_session_id into v_new_session_id from duplicate_session(p_session_id) d;
+
+    update sessions s
+    set is_open = true
+    where s.id = v_new_session_id
+    returning s.* into v_session;
+  end if;
+
+  return query select
+    v_session.id,
+    v_session.owner_id,
+    v_session.title,
+    v_session.created_at,
+    v_session.last_activity_at,
+    v_session.system_state_json,
+    v_session.user_state_json,
+    v_session.is_open,
+    case when v_session.id = p_session_id then null else p_session_id end;
+end;
+$$;
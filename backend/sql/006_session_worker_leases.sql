@@ -0,0 +1,95 @@
+-- Sessions are leased to the server that opened them, so that a restarting
+-- server only closes the sessions its former run left open, in chunks, while
+-- serving. Used by yourapp.sessions.claim_session and
+-- yourapp.sessions.close_worker_sessions, replaces the function of
+-- 005_claim_session.sql.
+--
+-- worker_id identifies a server across restarts, worker_lease one of its runs.
+
+alter table sessions
+  add column if not exists worker_id text,
+  add column if not exists worker_lease uuid;
+
+create index if not exists sessions_open_worker_id_idx
+  on sessions (worker_id) where is_open;
+
+drop function if exists claim_session(bigint, uuid);
+
+create or replace function claim_session(
+  p_session_id bigint,
+  p_owner_id uuid,
+  p_worker_id text default null,
+  p_worker_lease uuid default null
+)
+returns table (
+  id bigint,
+  owner_id uuid,
+  title character varying,
+  created_at timestamp,
+  last_activity_at timestamp,
+  system_state_json json,
+  user_state_json json,
+  is_open boolean,
+  duplicated_from bigint
+)
+language plpgsql
+as $$
+declare
+  v_session sessions;
+  v_new_session_id bigint;
+begin
+  update sessions s
+  set is_open = true, worker_id = p_worker_id, worker_lease = p_worker_lease
+  where s.id = p_session_id and s.owner_id = p_owner_id and not s.is_open
+  returning s.* into v_session;
+
+  if not found then
+    perform 1 from sessions s where s.id = p_session_id and s.owner_id = p_owner_id;
+    if not found then
+      return;
+    end if;
+
+    -- open already
+    select d.new_session_id into v_new_session_id from duplicate_session(p_session_id) d;
+
+    update sessions s
+    set is_open = true, worker_id = p_worker_id, worker_lease = p_worker_lease
+    where s.id = v_new_session_id
+    returning s.* into v_session;
+  end if;
+
+  return query select
+    v_session.id,
+    v_session.owner_id,
+    v_session.title,
+    v_session.created_at,
+    v_session.last_activity_at,
+    v_session.system_state_json,
+    v_session.user_state_json,
+    v_session.is_open,
+    case when v_session.id = p_session_id then null else p_session_id end;
+end;
+$$;
+
+-- Close up to p_limit sessions left open by former runs of p_worker_id,
+-- returning their ids. Rows being claimed meanwhile are skipped, not waited on.
+create or replace function close_worker_sessions(
+  p_worker_id text,
+  p_worker_lease uuid,
+  p_limit integer
+)
+returns setof bigint
+language sql
+as $$
+  update sessions s
+  set is_open = false
+  where s.id in (
+    select o.id
+    from sessions o
+    where o.is_open and o.worker_id = p_worker_id and o.worker_lease <> p_worker_lease
+    order by o.id
+    limit p_limit
+    for update skip locked
+  )
+  returning s.id;
+$$;
@@ -0,0 +1,110 @@
+-- Open sessions are kept alive by heartbeats of the server serving them, and
+-- are closed once they stop. Used by yourapp.sessions.claim_session,
+-- yourapp.sessions.heartbeat_sessions and yourapp.sessions.close_stale_sessions,
+-- replaces the function of 006_session_worker_leases.sql.
+--
+-- A session is stale when neither a heartbeat nor, for sessions opened before
+-- this migration, a tick was recorded for p_stale_after seconds.
+
+alter table sessions add column if not exists heartbeat_at timestamp;
+
+create index if not exists sessions_open_heartbeat_at_idx
+  on sessions ((coalesce(heartbeat_at, last_activity_at))) where is_open;
+
+drop function if exists claim_session(bigint, uuid, text, uuid);
+
+-- as in 006, stale open sessions being claimed as if they were closed
+create or replace function claim_session(
+  p_session_id bigint,
+  p_owner_id uuid,
+  p_worker_id text default null,
+  p_worker_lease uuid default null,
+  p_stale_after double precision default null
+)
+returns table (
+  id bigint,
+  owner_id uuid,
+  title character varying,
+  created_at timestamp,
+  last_activity_at timestamp,
+  system_state_json json,
+  user_state_json json,
+  is_open boolean,
+  duplicated_from bigint
+)
+language plpgsql
+as $$
+declare
+  v_session sessions;
+  v_new_session_id bigint;
+begin
+  update sessions s
+  set is_open = true, worker_id = p_worker_id, worker_lease = p_worker_lease, heartbeat_at = now()
+  where s.id = p_session_id and s.owner_id = p_owner_id and (
+    not s.is_open
+    or coalesce(s.heartbeat_at, s.last_activity_at) < now() - make_interval(secs => p_stale_after)
+  )
+  returning s.* into v_session;
+
+  if not found then
+    perform 1 from sessions s where s.id = p_session_id and s.owner_id = p_owner_id;
+    if not found then
+      return;
+    end if;
+
+    -- open and alive
+    select d.new_session_id into v_new_session_id from duplicate_session(p_session_id) d;
+
+    update sessions s
+    set is_open = true, worker_id = p_worker_id, worker_lease = p_worker_lease, heartbeat_at = now()
+    where s.id = v_new_session_id
+    returning s.* into v_session;
+  end if;
+
+  return query select
+    v_session.id,
+    v_session.owner_id,
+    v_session.title,
+    v_session.created_at,
+    v_session.last_activity_at,
+    v_session.system_state_json,
+    v_session.user_state_json,
+    v_session.is_open,
+    case when v_session.id = p_session_id then null else p_session_id end;
+end;
+$$;
+
+-- Record a heartbeat of the sessions still open and leased to p_worker_lease,
+-- returning their number.
+create or replace function heartbeat_sessions(p_session_ids bigint[], p_worker_lease uuid)
+returns bigint
+language sql
+as $$
+  with beaten as (
+    update sessions s
+    set heartbeat_at = now()
+    where s.id = any(p_session_ids) and s.is_open and s.worker_lease = p_worker_lease
+    returning 1
+  )
+  select count(*) from beaten;
+$$;
+
+-- Close up to p_limit stale sessions, returning their ids. Rows being claimed
+-- or beaten meanwhile are skipped, not waited on.
+create or replace function close_stale_sessions(p_stale_after double precision, p_limit integer)
+returns setof bigint
+language sql
+as $$
+  update sessions s
+  set is_open = false
+  where s.id in (
+    select o.id
+    from sessions o
+    where o.is_open
+      and coalesce(o.heartbeat_at, o.last_activity_at) < now() - make_interval(secs => p_stale_after)
+    order by coalesce(o.heartbeat_at, o.last_activity_at)
+    limit p_limit
+    for update skip locked
+  )
+  returning s.id;
+$$;
@@ -0,0 +1,21 @@
+-- Copied messages keep the time they were sent at rather than the time of the
+-- copy. Used by yourapp.sessions.duplicate_session through duplicate_session,
+-- replaces the function of 001_duplicate_session.sql.
+
+create or replace function copy_session_messages(p_old_session_id bigint, p_new_session_id bigint)
+returns bigint
+language plpgsql
+as $$
+declare
+  v_count bigint;
+begin
+  insert into "sessions messages" (session_id, payload_json, is_system, created_at)
+  select p_new_session_id, payload_json, is_system, created_at
+  from "sessions messages"
+  where session_id = p_old_session_id
+  order by id;
+
+  get diagnostics v_count = row_count;
+  return v_count;
+end;
+$$;
@@ -1,15 +1,119 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Optional
 import jwt
+from supabase import Client as SupabaseClient
+from supabase.lib.client_options import ClientOptions
 
+from yourapp.utils.ttl_cache import TTLCache
 
-def try_unwrap_jwt(app_secret: str, token: str) -> tuple[str, str, str]:
+
+_TOKENS_CACHE: Optional[TTLCache[str, tuple[str, str, str]]] = None
+_USER_CLIENTS_CACHE: Optional[TTLCache[str, SupabaseClient]] = None
+_CACHES_LOCK = threading.Lock()
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def get_tokens_cache() -> TTLCache[str, tuple[str, str, str]]:
+    """
+    Verified tokens, by digest, configured on first use by environment variables:
+    TOKENS_CACHE_TTL (seconds, default 300) and TOKENS_CACHE_SIZE (default 10000).
+    Tokens carry credentials, so this cache is never shared between processes.
+    """
+    global _TOKENS_CACHE
+    with _CACHES_LOCK:
+        if _TOKENS_CACHE is None:
+            _TOKENS_CACHE = TTLCache(
+                max_size=int(os.getenv("TOKENS_CACHE_SIZE", "10000")),
+                ttl=float(os.getenv("TOKENS_CACHE_TTL", "300")),
+            )
+        return _TOKENS_CACHE
+
+
+def get_user_clients_cache() -> TTLCache[str, SupabaseClient]:
+    """
+    Signed in Supabase clients, by token digest. They are dropped before their
+    session expires (Supabase's default is an hour) since they do not refresh it.
+    """
+    global _USER_CLIENTS_CACHE
+    with _CACHES_LOCK:
+        if _USER_CLIENTS_CACHE is None:
+            _USER_CLIENTS_CACHE = TTLCache(
+                max_size=int(os.getenv("USER_CLIENTS_CACHE_SIZE", "1000")),
+                ttl=float(os.getenv("USER_CLIENTS_CACHE_TTL", "1800")),
+            )
+        return _USER_CLIENTS_CACHE
+
+
+def decode_jwt(app_secret: str, token: str) -> Optional[dict]:
     try:
-        decoded = jwt.decode(token, app_secret, algorithms=["HS256"])
-        return (
-            decoded.get("id"),
-            decoded.get("credentials").get("email"),
-            decoded.get("credentials").get("password"),
-        )
+        return jwt.decode(token, app_secret, algorithms=["HS256"])
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
+
+
+def try_unwrap_jwt(app_secret: str, token: str) -> Optional[tuple[str, str, str]]:
+    """
+    Return the user id, email and password of a token, or None if it is invalid.
+    Verified tokens are cached until they expire, see `get_tokens_cache`.
+    """
+    cache = get_tokens_cache()
+    digest = token_digest(token)
+    unwrapped = cache.get(digest)
+    if unwrapped is not None:
+        return unwrapped
+
+    decoded = decode_jwt(app_secret, token)
+    if decoded is None:
+        return None
+    credentials = decoded.get("credentials") or {}
+    unwrapped = (
+        decoded.get("id"),
+        credentials.get("email"),
+        credentials.get("password"),
+    )
+
+    expires_at = decoded.get("exp")
+    if expires_at is None:
+        cache.set(digest, unwrapped)
+    elif expires_at > time.time():
+        cache.set(digest, unwrapped, ttl=expires_at - time.time())
+    return unwrapped
+
+
+def get_user_client(
+    supabase_project_url: str,
+    supabase_public_api_key: str,
+    token: str,
+    email: str,
+    password: str,
+) -> SupabaseClient:
+    """
+    Return a Supabase client signed in as the token's user, reusing the one of
+    the previous requests with the same token. Raises if the sign in fails.
+    """
+
+    def sign_in(_digest: str) -> SupabaseClient:
+        client = SupabaseClient(
+            supabase_project_url,
+            supabase_public_api_key,
+            options=ClientOptions(auto_refresh_token=False, persist_session=False),
+        )
+        client.auth.sign_in_with_password({"email": email, "password": password})
+        return client
+
+    return get_user_clients_cache().get_or_load(token_digest(token), sign_in)
+
+
+def release_user_client(token: str):
+    """Sign the token's user client out and forget it, e.g. once its password changed."""
+    client = get_user_clients_cache().invalidate(token_digest(token))
+    if client is not None:
+        client.auth.sign_out()
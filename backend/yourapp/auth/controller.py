@@ -3,8 +3,8 @@ from functools import wraps
 from supabase import Client as SupabaseClient
 
 from flask_cors import cross_origin
-from yourapp.auth.providers import SupabaseAuthProvider
-from yourapp.auth import try_unwrap_jwt
+from yourapp.auth.providers import AuthProviderBusyError, SupabaseAuthProvider
+from yourapp.auth import get_user_client, release_user_client, try_unwrap_jwt
 from yourapp.user import get_user_infos, onboard_user
 
 
@@ -15,19 +15,17 @@ def init_auth_routes(
     supabase_public_api_key: str,
     admin_client: SupabaseClient,
 ):
+    auth_provider = SupabaseAuthProvider(supabase_public_api_key, supabase_project_url)
+
     @app.route("/login", methods=["POST"])
     @cross_origin()
     def login():
         credentials = request.json
 
-        auth_provider = SupabaseAuthProvider(
-            supabase_public_api_key, supabase_project_url
-        )
-
-        if auth_provider is None:
-            return jsonify({"error": "Invalid credentials"}), 401
-
-        access_token = auth_provider.authenticate(app_secret, credentials)
+        try:
+            access_token = auth_provider.authenticate(app_secret, credentials)
+        except AuthProviderBusyError:
+            return jsonify({"error": "Too many logins, retry shortly"}), 503
         if access_token is None:
             return jsonify({"error": "Invalid credentials"}), 401
 
@@ -68,16 +66,24 @@ def init_auth_routes(
         @wraps(func)
         def wrapper(*args, **kwargs):
             token = request.args.get("token")
-            user_id, email, password = try_unwrap_jwt(app_secret, token)
-            client = SupabaseClient(supabase_project_url, supabase_public_api_key)
-            data = client.auth.sign_in_with_password(
-                {"email": email, "password": password}
-            )
-            if data is None:
+            if token is None:
                 return jsonify({"error": "Unauthorized"}), 401
+
+            result = try_unwrap_jwt(app_secret, token)
+            if result is None:
+                return jsonify({"error": "Unauthorized"}), 401
+
+            user_id, email, password = result
             if user_id is None:
                 return jsonify({"error": "Unauthorized"}), 401
 
+            try:
+                client = get_user_client(
+                    supabase_project_url, supabase_public_api_key, token, email, password
+                )
+            except Exception:
+                return jsonify({"error": "Unauthorized"}), 401
+
             return func(*args, **kwargs, user_id=user_id, client=client)
 
         return wrapper
@@ -95,7 +101,8 @@ def init_auth_routes(
         result = onboard_user(
             client, admin_client, user_id, data["username"], data["password"]
         )
-        client.auth.sign_out()
+        # the token's password is not valid anymore
+        release_user_client(request.args.get("token"))
         if result is None:
             return jsonify({"error": "Onboarding failed"}), 500
         return jsonify({})
@@ -1,7 +1,17 @@
+import hashlib
+import json
+import os
+import queue
+import threading
 from abc import ABC, abstractmethod
+from typing import Optional
+from gotrue.errors import AuthApiError, AuthInvalidCredentialsError
 from supabase import Client as SupabaseClient
+from supabase.lib.client_options import ClientOptions
 import jwt
 
+from yourapp.utils.ttl_cache import TTLCache
+
 
 class AuthProvider(ABC):
     @abstractmethod
@@ -23,21 +33,67 @@ class AuthProvider(ABC):
         pass
 
 
+class AuthProviderBusyError(Exception):
+    """Raised when an auth provider has too many authentications in flight to take another one."""
+
+
 class SupabaseAuthProvider(AuthProvider):
+    """
+    Authenticates with a pool of long-lived Supabase clients, which also caps
+    the number of sign ins in flight: further ones wait up to `acquire_timeout`
+    seconds for a client, then fail with `AuthProviderBusyError`.
+
+    Credentials rejected by Supabase are remembered for `failure_ttl` seconds
+    and rejected right away in the meantime.
+
+    Both default to environment variables: AUTH_POOL_SIZE (default 8) and
+    AUTH_FAILURE_TTL (seconds, default 30).
+    """
+
     supabase_key: str
     supabase_url: str
 
-    def __init__(self, supabase_key: str, supabase_url: str):
+    def __init__(
+        self,
+        supabase_key: str,
+        supabase_url: str,
+        pool_size: Optional[int] = None,
+        acquire_timeout: float = 10.0,
+        failure_ttl: Optional[float] = None,
+    ):
         self.supabase_key = supabase_key
         self.supabase_url = supabase_url
+        self.pool_size = (
+            pool_size if pool_size is not None else int(os.getenv("AUTH_POOL_SIZE", "8"))
+        )
+        self.acquire_timeout = acquire_timeout
+        self.failures: TTLCache[str, bool] = TTLCache(
+            max_size=10000,
+            ttl=(
+                failure_ttl
+                if failure_ttl is not None
+                else float(os.getenv("AUTH_FAILURE_TTL", "30"))
+            ),
+        )
+
+        self._clients: queue.LifoQueue[SupabaseClient] = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
 
     def corresponds_to_credentials(self, _credentials: dict):
         return True
 
     def authenticate(self, app_secret: str, credentials: dict):
-        # Authenticate with Supabase
+        failure_key = hashlib.sha256(
+            json.dumps(credentials, sort_keys=True).encode()
+        ).hexdigest()
+        if self.failures.get(failure_key) is not None:
+            return None
+
+        client = None
         try:
-            client = SupabaseClient(self.supabase_url, self.supabase_key)
+            client = self._acquire()
+            # Authenticate with Supabase
             data = client.auth.sign_in_with_password(credentials)
             client.auth.sign_out()
 
@@ -47,5 +103,39 @@ class SupabaseAuthProvider(AuthProvider):
                 {"id": id, "credentials": credentials}, app_secret, algorithm="HS256"
             )
 
+        except AuthProviderBusyError:
+            raise
+        except (AuthInvalidCredentialsError, AuthApiError) as e:
+            if isinstance(e, AuthInvalidCredentialsError) or e.status == 400:
+                self.failures.set(failure_key, True)
+            return None
         except Exception:
             return None
+        finally:
+            if client is not None:
+                self._clients.put(client)
+
+    def _acquire(self) -> SupabaseClient:
+        try:
+            return self._clients.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.pool_size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return SupabaseClient(
+                    self.supabase_url,
+                    self.supabase_key,
+                    options=ClientOptions(auto_refresh_token=False, persist_session=False),
+                )
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._clients.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise AuthProviderBusyError()
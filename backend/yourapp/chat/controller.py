@@ -1,13 +1,24 @@
-import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from flask import jsonify, request
 from flask_cors import cross_origin
 from loguru import logger
-from simple_websocket import Server, ConnectionClosed
+from simple_websocket import ConnectionClosed
 from supabase import Client as SupabaseClient
 from datetime import datetime
+from typing import Optional
 
+from yourapp.chat.live import (
+    IDLE_CLOSE_CODE,
+    ChatIdleError,
+    ChatSender,
+    accept_websocket,
+    register_live_session,
+    unregister_live_session,
+)
 from yourapp.chat.payload import Payload
-from yourapp.chat.payloads import PayloadOpenChat, payload_from_dict
+from yourapp.chat.payloads import PayloadDecodeError, PayloadOpenChat, payload_from_dict
 from yourapp.core.system_states.registry import system_state_from_dict
 from yourapp.core.system_states.start_state import new_start_state
 from yourapp.core.system_states.util_states import NULL_STATE
@@ -15,16 +26,39 @@ from yourapp.sessions import (
     add_session,
     delete_session,
     get_session,
-    update_states,
-    open_session,
+    claim_session,
     close_session,
-    duplicate_session,
 )
-from yourapp.sessions.messages import Message, add_multiple_messages, get_messages
+from yourapp.sessions.messages import Message, get_last_messages, messages_to_json
+from yourapp.sessions.persistence import SessionWriter
 from yourapp.user import get_user_infos
+from yourapp.utils import codec
+from yourapp.utils.logging import StageTimings
+
+
+_PREFETCH_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_PREFETCH_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_prefetch_executor() -> ThreadPoolExecutor:
+    """
+    Runs the queries of connecting chats that do not depend on each other,
+    configured on first use by CHAT_PREFETCH_WORKERS (threads, default 16).
+    """
+    global _PREFETCH_EXECUTOR
+    with _PREFETCH_EXECUTOR_LOCK:
+        if _PREFETCH_EXECUTOR is None:
+            _PREFETCH_EXECUTOR = ThreadPoolExecutor(
+                max_workers=int(os.getenv("CHAT_PREFETCH_WORKERS", "16")),
+                thread_name_prefix="chat-prefetch",
+            )
+        return _PREFETCH_EXECUTOR
 
 
 def init_chat_routes(app, login_required, admin_client: SupabaseClient):
+    # chats waiting longer on their user are parked, 0 to wait indefinitely
+    receive_timeout = float(os.getenv("CHAT_RECEIVE_TIMEOUT", "300")) or None
+
     @app.route("/chat/<session_id>", websocket=True)
     @cross_origin()
     @login_required
@@ -32,37 +66,35 @@ def init_chat_routes(app, login_required, admin_client: SupabaseClient):
         logger.info(f"user {user_id} session {session_id} chat requested")
 
         session_id = int(session_id)
-        ws = Server.accept(request.environ)
+        ws = accept_websocket(request.environ)
         ws.send(
-            json.dumps(
+            codec.dumps(
                 Message(
                     id=None,
                     created_at=datetime.now(),
                     payload={"type": "connected"},
                     is_system=True,
-                ).to_dict()
+                )
             )
         )
 
         logger.info(f"user {user_id} session {session_id} websocket connected")
 
-        user = get_user_infos(admin_client, user_id)
-
-        if user is None:
-            logger.critical(
-                f"user {user_id} session {session_id} user not found inconsistency"
-            )
-            return jsonify({"error": "User not found"}), 404
-
-        system_state = new_start_state()
-        user_state = {}
+        # independent queries overlap, connecting takes as long as the slowest
+        timings = StageTimings()
+        user_future = get_prefetch_executor().submit(
+            timings.timed("user", get_user_infos), admin_client, user_id
+        )
+        history_future = None
+        created = session_id == -1
 
-        if session_id == -1:
+        if created:
             logger.info(f"user {user_id} creating new session")
 
-            result = add_session(
-                admin_client, user_id, system_state.to_dict(), user_state
-            )
+            with timings.stage("create"):
+                result = add_session(
+                    admin_client, user_id, new_start_state().to_dict(), {}
+                )
             if result is None:
                 logger.error(f"user {user_id} failed to create new session")
                 return jsonify({"error": "Session creation failed"}), 500
@@ -72,105 +104,153 @@ def init_chat_routes(app, login_required, admin_client: SupabaseClient):
             logger.info(f"user {user_id} session {session_id} created")
 
             ws.send(
-                json.dumps(
+                codec.dumps(
                     Message(
                         id=None,
                         created_at=datetime.now(),
                         payload={"type": "session_created", "id": session_id},
                         is_system=True,
-                    ).to_dict()
+                    )
                 )
             )
-
-        session = get_session(admin_client, session_id)
-        if session is None:
-            logger.error(f"user {user_id} session {session_id} not found")
-            return jsonify({"error": "Session not found"}), 404
-        if session.owner_id != user_id:
-            logger.warning(
-                f"user {user_id} requested user {session.owner_id}'s session {session_id}"
-            )
-            return jsonify({"error": "Unauthorized"}), 401
-        if session.is_open:
-            logger.info(
-                f"user {user_id} session {session_id} already open, attempting duplication"
+        else:
+            # the history is the same whether the session gets opened or not
+            history_future = get_prefetch_executor().submit(
+                timings.timed("history", get_last_messages), admin_client, session_id
             )
-            result = duplicate_session(admin_client, session_id)
-            if result is None:
-                logger.error(f"user {user_id} session {session_id} failed to duplicate")
-                return jsonify({"error": "Session duplication failed"}), 500
-            logger.info(f"user {user_id} session {session_id} duplicated to {result}")
-            session_id = result
 
-        result = open_session(admin_client, session_id)
-        if result is None:
+        # opened if closed, duplicated if open, atomically
+        with timings.stage("claim"):
+            session = claim_session(admin_client, session_id, user_id)
+        if session is None:
+            # tells a missing session apart from another user's or a failure
+            session = get_session(admin_client, session_id)
+            if session is None:
+                logger.error(f"user {user_id} session {session_id} not found")
+                return jsonify({"error": "Session not found"}), 404
+            if session.owner_id != user_id:
+                logger.warning(
+                    f"user {user_id} requested user {session.owner_id}'s session {session_id}"
+                )
+                return jsonify({"error": "Unauthorized"}), 401
             logger.error(f"user {user_id} session {session_id} failed to open")
             return jsonify({"error": "Failed to open session"}), 500
+        if session.id != session_id:
+            logger.info(
+                f"user {user_id} session {session_id} already open, duplicated to {session.id}"
+            )
+            session_id = session.id
+            # the copies of the messages have ids of their own
+            history_future = None
 
         logger.info(f"user {user_id} session {session_id} opened")
 
+        user = user_future.result()
+        if user is None:
+            logger.critical(
+                f"user {user_id} session {session_id} user not found inconsistency"
+            )
+            if created:
+                # created for nothing, the user lookup having run meanwhile
+                delete_session(admin_client, session_id)
+            else:
+                close_session(admin_client, session_id)
+            return jsonify({"error": "User not found"}), 404
+
         system_state = system_state_from_dict(session.system_state)
         user_state = session.user_state
 
-        history = get_messages(admin_client, session_id)
-        if history is None:
-            logger.error(f"user {user_id} session {session_id} failed to get history")
-            return jsonify({"error": "Failed to get session messages"}), 500
+        # only the newest page is loaded, older pages are fetched through the REST API
+        if created:
+            history, cursor = [], None
+        else:
+            if history_future is not None:
+                result = history_future.result()
+            else:
+                with timings.stage("history"):
+                    result = get_last_messages(admin_client, session_id)
+            if result is None:
+                logger.error(f"user {user_id} session {session_id} failed to get history")
+                return jsonify({"error": "Failed to get session messages"}), 500
+            history, cursor = result
 
-        try:
-            for message in history[:-1]:
-                ws.send(json.dumps(message.to_dict()))
+        logger.info(f"user {user_id} session {session_id} connected in {timings}")
+
+        writer = SessionWriter(
+            admin_client,
+            session_id,
+            system_state=session.system_state,
+            user_state=session.user_state,
+        )
+        sender = ChatSender(ws, session_id)
+        register_live_session(session_id, ws, writer)
+        parked = False
+
+        def receive() -> dict:
+            data = ws.receive(timeout=receive_timeout)
+            if data is None:
+                raise ChatIdleError()
+            return codec.loads(data)
 
+        try:
             if len(history) > 0:
+                # the messages' raw payloads are spliced in, never decoded
+                sender.send(
+                    Message(
+                        id=None,
+                        created_at=datetime.now(),
+                        payload=None,
+                        is_system=True,
+                        payload_json=(
+                            f'{{"type":"history","messages":{messages_to_json(history)},'
+                            f'"cursor":{codec.dumps(cursor)},"session_id":{session_id}}}'
+                        ),
+                    ).to_json()
+                )
+                logger.info(
+                    f"user {user_id} session {session_id} sent {len(history)} history messages"
+                )
+
                 last_message = history[-1]
-                ws.send(json.dumps(last_message.to_dict()))
-                logger.info(f"user {user_id} session {session_id} sent entire history")
 
                 payload = payload_from_dict(last_message.payload)
                 is_system = last_message.is_system
                 requires_user_input = payload.requires_user_input()
                 if is_system and requires_user_input:
-                    data = ws.receive()
-                    input_payload = json.loads(data)
-                    received_messages = add_multiple_messages(
-                        admin_client, session_id, [input_payload], False
-                    )
-                    if received_messages is None:
-                        logger.error(
-                            f"user {user_id} session {session_id} failed to persist user message"
-                        )
-                        return jsonify({"error": "Failed to persist user message"}), 500
+                    input_payload = receive()
+                    received_messages = writer.add_messages([input_payload], False)
                     for received_message in received_messages:
-                        ws.send(json.dumps(received_message.to_dict()))
+                        sender.send(received_message.to_json())
                         history += [received_message]
 
             logger.info(f"user {user_id} session {session_id} starting chat loop")
 
             def send_payload(payload):
-                ws.send(
-                    json.dumps(
+                sender.send(
+                    codec.dumps(
                         {
                             "payload": payload.to_dict(),
                             "id": -1,
-                            "created_at": datetime.now().isoformat(),
+                            "created_at": datetime.now(),
                             "is_system": True,
                         }
-                    )
+                    ),
+                    # statuses and deltas are superseded by the final messages
+                    droppable=not payload.requires_user_input(),
                 )
 
             def expect_payload() -> Payload:
                 send_payload(PayloadOpenChat())
-                data = ws.receive()
-                payload_dict = json.loads(data)
-                message_sendback = json.dumps(
+                payload_dict = receive()
+                message_sendback = codec.dumps(
                     {
                         "payload": payload_dict,
                         "id": -1,
-                        "created_at": datetime.now().isoformat(),
+                        "created_at": datetime.now(),
                         "is_system": False,
                     }
                 )
-                ws.send(message_sendback)
+                sender.send(message_sendback)
                 return payload_from_dict(payload_dict)
 
             while system_state != NULL_STATE:
@@ -178,75 +258,76 @@ def init_chat_routes(app, login_required, admin_client: SupabaseClient):
                     user, history, send_payload, expect_payload
                 )
 
-                result = update_states(
-                    admin_client, session_id, system_state.to_dict(), user_state
-                )
-                if result is None:
-                    logger.error(
-                        f"user {user_id} session {session_id} failed to persist updated session states"
-                    )
-                    return (
-                        jsonify({"error": "Failed to persist updated session states"}),
-                        500,
-                    )
-
+                # persisted in the background, in one transaction per tick
+                writer.update_states(system_state.to_dict(), user_state)
                 payloads_dicts = [payload.to_dict() for payload in payloads]
-                messages = add_multiple_messages(
-                    admin_client, session_id, payloads_dicts, True
-                )
-                if messages is None:
-                    logger.error(
-                        f"user {user_id} session {session_id} failed to persist system messages"
-                    )
-                    return jsonify({"error": "Failed to persist system messages"}), 500
+                messages = writer.add_messages(payloads_dicts, True)
 
-                for message in messages:
-                    ws.send(json.dumps(message.to_dict()))
+                for message, payload in zip(messages, payloads):
+                    sender.send(message.to_json())
                     history += [message]
-                    payload = payload_from_dict(message.payload)
                     if payload.requires_user_input():
-                        data = ws.receive()
-                        input_payload = json.loads(data)
-                        received_messages = add_multiple_messages(
-                            admin_client, session_id, [input_payload], False
-                        )
-                        if received_messages is None:
-                            logger.error(
-                                f"user {user_id} session {session_id} failed to persist user message"
-                            )
-                            return (
-                                jsonify({"error": "Failed to persist user message"}),
-                                500,
-                            )
+                        input_payload = receive()
+                        received_messages = writer.add_messages([input_payload], False)
                         for received_message in received_messages:
-                            ws.send(json.dumps(received_message.to_dict()))
+                            sender.send(received_message.to_json())
                             history += [received_message]
 
+            writer.flush()
+
+        except ChatIdleError:
+            # a tick interrupted while waiting is executed again on resume
+            logger.info(
+                f"user {user_id} session {session_id} idle for {receive_timeout}s, parking"
+            )
+            parked = True
         except ConnectionClosed:
             logger.info(f"user {user_id} session {session_id} closed websocket")
+        except PayloadDecodeError as e:
+            logger.warning(f"user {user_id} session {session_id} sent an invalid payload: {e}")
         except Exception as e:
             logger.error(
                 f"user {user_id} session {session_id} exception raised in chat"
             )
             logger.exception(e)
 
-        all_history_message_are_system = all([message.is_system for message in history])
-        if all_history_message_are_system:
-            logger.info(
-                f"user {user_id} session {session_id} all messages from system, deleting"
-            )
-            result = delete_session(admin_client, session_id)
-            if result is None:
+        sender.close()
+        if parked:
+            try:
+                ws.close(reason=IDLE_CLOSE_CODE, message="Idle")
+            except (ConnectionClosed, OSError):
+                pass  # closed by the client meanwhile
+
+        try:
+            if not writer.close():
                 logger.error(
-                    f"user {user_id} session {session_id} failed to delete session"
+                    f"user {user_id} session {session_id} failed to persist session"
                 )
-                return jsonify({"error": "Failed to delete session"}), 500
-        else:
-            logger.info(f"user {user_id} session {session_id} closing session")
-            result = close_session(admin_client, session_id)
-            if result is None:
-                logger.error(
-                    f"user {user_id} session {session_id} failed to close session"
+                return jsonify({"error": "Failed to persist session"}), 500
+
+            # older pages were not loaded: the session has been used, keep it
+            all_history_message_are_system = cursor is None and all(
+                [message.is_system for message in history]
+            )
+            # parked sessions are kept for their user to resume them
+            if all_history_message_are_system and not parked:
+                logger.info(
+                    f"user {user_id} session {session_id} all messages from system, deleting"
                 )
-                return jsonify({"error": "Failed to close session"}), 500
-        return "end"
+                result = delete_session(admin_client, session_id)
+                if result is None:
+                    logger.error(
+                        f"user {user_id} session {session_id} failed to delete session"
+                    )
+                    return jsonify({"error": "Failed to delete session"}), 500
+            else:
+                logger.info(f"user {user_id} session {session_id} closing session")
+                result = close_session(admin_client, session_id)
+                if result is None:
+                    logger.error(
+                        f"user {user_id} session {session_id} failed to close session"
+                    )
+                    return jsonify({"error": "Failed to close session"}), 500
+            return "end"
+        finally:
+            unregister_live_session(session_id)
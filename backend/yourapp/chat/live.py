@@ -0,0 +1,272 @@
+import os
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+from loguru import logger
+from simple_websocket import ConnectionClosed, Server
+from supabase import Client as SupabaseClient
+
+from yourapp.sessions import (
+    CLOSE_STALE_SESSIONS_CHUNK_SIZE,
+    close_session,
+    close_stale_sessions,
+    heartbeat_sessions,
+)
+from yourapp.sessions.persistence import SessionWriter
+
+
+@dataclass
+class LiveSession:
+    ws: Server
+    writer: SessionWriter
+
+
+_LIVE_SESSIONS: dict[int, LiveSession] = {}
+_LIVE_SESSIONS_CONDITION = threading.Condition()
+
+WEBSOCKET_ENVIRON_KEY = "yourapp.websocket"
+
+
+def accept_websocket(environ: dict) -> Server:
+    """Upgrade the request to a websocket, marking it for `websocket_wsgi_middleware`."""
+    ws = Server.accept(environ)
+    environ[WEBSOCKET_ENVIRON_KEY] = ws
+    return ws
+
+
+def websocket_wsgi_middleware(wsgi_app):
+    """
+    Gunicorn writes the handler's HTTP response once it returns, which fails on
+    a socket upgraded to a websocket. Close the websocket instead and tell
+    gunicorn to drop the connection.
+
+    The websocket's reader must be done with the socket before gunicorn closes
+    it, or it could end up reading from the next connection given the same file
+    descriptor.
+    """
+
+    def middleware(environ, start_response):
+        response = wsgi_app(environ, start_response)
+        ws = environ.get(WEBSOCKET_ENVIRON_KEY)
+        if ws is None or ws.mode != "gunicorn":
+            return response
+        try:
+            ws.close()
+        except (ConnectionClosed, OSError):
+            pass  # already closed by the client
+        ws.thread.join(timeout=1.0)
+        if ws.thread.is_alive():
+            # the client did not acknowledge the close, wake the reader up
+            try:
+                ws.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            ws.thread.join()
+        raise StopIteration()
+
+    return middleware
+
+
+# close code of the websockets of parked chats, the client resumes them by reconnecting
+IDLE_CLOSE_CODE = 4000
+
+
+class ChatIdleError(Exception):
+    """The user sent nothing within the receive timeout, the chat is to be parked."""
+
+
+_SENDER_POOL: Optional[ThreadPoolExecutor] = None
+_SENDER_POOL_LOCK = threading.Lock()
+
+
+def get_sender_pool() -> ThreadPoolExecutor:
+    """
+    Threads draining the send queues of every chat of this process, configured
+    on first use by CHAT_SENDER_THREADS (default 16).
+    """
+    global _SENDER_POOL
+    with _SENDER_POOL_LOCK:
+        if _SENDER_POOL is None:
+            _SENDER_POOL = ThreadPoolExecutor(
+                max_workers=int(os.getenv("CHAT_SENDER_THREADS", "16")),
+                thread_name_prefix="chat-sender",
+            )
+        return _SENDER_POOL
+
+
+class ChatSender:
+    """
+    Bounded send queue of a chat's websocket.
+
+    Frames are sent by the threads of `get_sender_pool`, so that a slow client
+    does not hold the chat loop up, each chat sending at most `frames_per_turn`
+    frames before letting the others go. Once `max_queued` frames are waiting,
+    new droppable frames (statuses and streamed deltas, which final messages
+    supersede) are dropped, and any other frame disconnects the client, too
+    slow to follow the chat, which also frees the thread it was blocking.
+    """
+
+    ws: Server
+    session_id: int
+    max_queued: int
+    frames_per_turn: int = 32
+
+    def __init__(self, ws: Server, session_id: int, max_queued: Optional[int] = None):
+        self.ws = ws
+        self.session_id = session_id
+        self.max_queued = (
+            max_queued
+            if max_queued is not None
+            else int(os.getenv("CHAT_SEND_QUEUE_SIZE", "256"))
+        )
+
+        self._condition = threading.Condition()
+        self._frames: deque[str] = deque()
+        self._dropped = 0
+        self._draining = False
+        self._disconnected = False
+
+    def send(self, frame: str, droppable: bool = False):
+        """Queue a frame, raising ConnectionClosed once the client is disconnected."""
+        with self._condition:
+            if self._disconnected:
+                raise ConnectionClosed()
+            if len(self._frames) >= self.max_queued:
+                if droppable:
+                    self._dropped += 1
+                    return
+                logger.warning(
+                    f"session {self.session_id} client too slow, {len(self._frames)} frames queued, disconnecting"
+                )
+                self._disconnect()
+                raise ConnectionClosed()
+            self._frames.append(frame)
+            if not self._draining:
+                self._draining = True
+                get_sender_pool().submit(self._drain)
+
+    def close(self, timeout: float = 5.0):
+        """Wait for the frames still queued to be sent, for at most `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._draining and not self._disconnected and time.monotonic() < deadline:
+                self._condition.wait(deadline - time.monotonic())
+            if self._draining and not self._disconnected:
+                self._disconnect()
+        if self._dropped > 0:
+            logger.info(f"session {self.session_id} dropped {self._dropped} frames")
+
+    def _disconnect(self):
+        # a thread of the pool may be blocked on a full socket, unblock it
+        self._disconnected = True
+        self._frames.clear()
+        self._condition.notify_all()
+        try:
+            self.ws.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _drain(self):
+        for _ in range(self.frames_per_turn):
+            with self._condition:
+                if self._disconnected or len(self._frames) == 0:
+                    self._draining = False
+                    self._condition.notify_all()
+                    return
+                frame = self._frames.popleft()
+            try:
+                self.ws.send(frame)
+            except (ConnectionClosed, OSError):
+                with self._condition:
+                    self._disconnected = True
+                    self._frames.clear()
+                    self._draining = False
+                    self._condition.notify_all()
+                return
+        # behind the turns of the other chats
+        get_sender_pool().submit(self._drain)
+
+
+def register_live_session(session_id: int, ws: Server, writer: SessionWriter):
+    with _LIVE_SESSIONS_CONDITION:
+        _LIVE_SESSIONS[session_id] = LiveSession(ws=ws, writer=writer)
+
+
+def unregister_live_session(session_id: int):
+    with _LIVE_SESSIONS_CONDITION:
+        _LIVE_SESSIONS.pop(session_id, None)
+        _LIVE_SESSIONS_CONDITION.notify_all()
+
+
+def count_live_sessions() -> int:
+    with _LIVE_SESSIONS_CONDITION:
+        return len(_LIVE_SESSIONS)
+
+
+def start_session_heartbeats(client: SupabaseClient) -> threading.Thread:
+    """
+    Every SESSION_HEARTBEAT_INTERVAL seconds (default 30), record a heartbeat of
+    the sessions this process serves, in one query whatever their number, then
+    close the sessions of any server that stopped sending them.
+
+    Idle chats waiting for their user are live sessions too, so heartbeats come
+    from here rather than from the chat loops.
+    """
+    interval = float(os.getenv("SESSION_HEARTBEAT_INTERVAL", "30"))
+
+    def beat():
+        while True:
+            time.sleep(interval)
+            with _LIVE_SESSIONS_CONDITION:
+                session_ids = list(_LIVE_SESSIONS.keys())
+            if len(session_ids) > 0:
+                heartbeat_sessions(client, session_ids)
+
+            closed = close_stale_sessions(client)
+            while closed is not None and len(closed) > 0:
+                logger.warning(f"closed {len(closed)} sessions left open by a dead server")
+                if len(closed) < CLOSE_STALE_SESSIONS_CHUNK_SIZE:
+                    break
+                closed = close_stale_sessions(client)
+
+    thread = threading.Thread(target=beat, name="session-heartbeats", daemon=True)
+    thread.start()
+    return thread
+
+
+def close_live_sessions(client: SupabaseClient, timeout: float = 10.0) -> int:
+    """
+    Disconnect every chat served by this process, for a graceful shutdown.
+
+    The websockets are closed so that each chat handler persists and closes its
+    own session. Sessions whose handler did not finish within `timeout` seconds
+    are persisted and closed from here. Returns the number of sessions closed.
+    """
+    with _LIVE_SESSIONS_CONDITION:
+        live_sessions = list(_LIVE_SESSIONS.items())
+    if len(live_sessions) == 0:
+        return 0
+
+    logger.info(f"closing {len(live_sessions)} live sessions")
+    for session_id, live_session in live_sessions:
+        try:
+            live_session.ws.close(reason=1001, message="Server shutting down")
+        except Exception as e:
+            logger.warning(f"session {session_id} websocket failed to close: {e}")
+
+    deadline = time.monotonic() + timeout
+    with _LIVE_SESSIONS_CONDITION:
+        while len(_LIVE_SESSIONS) > 0 and time.monotonic() < deadline:
+            _LIVE_SESSIONS_CONDITION.wait(deadline - time.monotonic())
+        leftovers = list(_LIVE_SESSIONS.items())
+        _LIVE_SESSIONS.clear()
+
+    for session_id, live_session in leftovers:
+        logger.warning(f"session {session_id} handler still running, closing it")
+        live_session.writer.close(retries=1)
+        close_session(client, session_id)
+    return len(live_sessions)
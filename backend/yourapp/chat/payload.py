@@ -3,6 +3,10 @@ from typing import Optional
 
 
 class Payload(ABC):
+    __slots__ = ()
+
+    # (type, state) of the dicts decoded to this class, set by `register_payload`
+    payload_key: tuple[str, Optional[str]]
 
     @abstractmethod
     def to_dict(self) -> dict:
@@ -13,5 +17,16 @@ class Payload(ABC):
 
     @staticmethod
     @abstractmethod
-    def try_from_dict(data: dict) -> Optional["Payload"]:
+    def from_fields(data: dict) -> "Payload":
+        """Build the payload from a dict already known to be of its type, validating its fields."""
         pass
+
+    @classmethod
+    def try_from_dict(cls, data: dict) -> Optional["Payload"]:
+        """Decode a dict of this payload's type, return None for other types."""
+        payload_type, state = cls.payload_key
+        if data.get("type") != payload_type or (
+            state is not None and data.get("state") != state
+        ):
+            return None
+        return cls.from_fields(data)
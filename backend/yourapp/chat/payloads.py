@@ -1,53 +1,147 @@
-from typing import Optional
+from typing import Any, Callable, Optional, TypeVar
 from yourapp.chat.payload import Payload
 
 
+PAYLOADS_REGISTRY: dict[tuple[str, Optional[str]], type[Payload]] = {}
+# payload types told apart by their "state" field
+_STATEFUL_TYPES: set[str] = set()
+
+P = TypeVar("P", bound=type[Payload])
+
+
+class PayloadDecodeError(ValueError):
+    """
+    A payload dict that could not be decoded: its `field` is missing or invalid,
+    or its type is unknown when `field` is "type". `index` is its position when
+    decoded in bulk.
+    """
+
+    def __init__(self, reason: str, field: Optional[str] = None, index: Optional[int] = None):
+        super().__init__(reason if index is None else f"payload {index}: {reason}")
+        self.reason = reason
+        self.field = field
+        self.index = index
+
+    def to_dict(self) -> dict:
+        return {"reason": self.reason, "field": self.field, "index": self.index}
+
+
+def register_payload(type: str, state: Optional[str] = None) -> Callable[[P], P]:
+    """Class decorator making `payload_from_dict` decode dicts of this type, and state, with the class."""
+
+    def register(cls: P) -> P:
+        if state is not None:
+            _STATEFUL_TYPES.add(type)
+        PAYLOADS_REGISTRY[(type, state)] = cls
+        cls.payload_key = (type, state)
+        return cls
+
+    return register
+
+
 def payload_from_dict(data: dict) -> Payload:
-    payload_type = data.get("type")
-    if payload_type == "message":
-        return PayloadChat.try_from_dict(data)
-    elif payload_type == "state" and data.get("state") == "closed":
-        return PayloadCloseChat.try_from_dict(data)
-    elif payload_type == "state" and data.get("state") == "opened":
-        return PayloadOpenChat.try_from_dict(data)
-    elif payload_type == "end":
-        return PayloadEndSession.try_from_dict(data)
-    elif payload_type == "dict":
-        return PayloadDict.try_from_dict(data)
-    elif payload_type == "text-file":
-        return PayloadTextFile.try_from_dict(data)
-    raise ValueError(f"Unknown payload type: {data['type']}")
+    """Validate and decode a payload dict in one pass. Raises PayloadDecodeError."""
+    if not isinstance(data, dict):
+        raise PayloadDecodeError("payload is not an object")
+    # unhashable values would fail the registry lookup
+    payload_type = _field(data, "type", str)
+    state = _field(data, "state", str) if payload_type in _STATEFUL_TYPES else None
+    cls = PAYLOADS_REGISTRY.get((payload_type, state))
+    if cls is None:
+        raise PayloadDecodeError(f"unknown payload type: {payload_type}", field="type")
+    return cls.from_fields(data)
+
+
+def payloads_from_dicts(
+    data: list[dict],
+) -> tuple[list[Optional[Payload]], list[PayloadDecodeError]]:
+    """
+    Decode payload dicts in bulk. Returns the payloads, None in place of the
+    invalid ones, and the errors of the invalid ones, which carry their index.
+    """
+    payloads: list[Optional[Payload]] = []
+    errors: list[PayloadDecodeError] = []
+    for index, payload_dict in enumerate(data):
+        try:
+            payloads.append(payload_from_dict(payload_dict))
+        except PayloadDecodeError as e:
+            payloads.append(None)
+            errors.append(PayloadDecodeError(e.reason, e.field, index))
+    return payloads, errors
+
+
+def _field(data: dict, name: str, kind: type, nullable: bool = False) -> Any:
+    value = data.get(name)
+    # nullable fields may be null, not missing
+    if value is None and nullable and name in data:
+        return None
+    if not isinstance(value, kind):
+        if value is None:
+            raise PayloadDecodeError(f"missing {name}", field=name)
+        raise PayloadDecodeError(f"{name} must be a {kind.__name__}", field=name)
+    return value
 
 
+@register_payload("message")
 class PayloadChat(Payload):
-    message: str
+    __slots__ = ("message",)
+
+    # None when the LLM answering failed, as persisted by the example states
+    message: Optional[str]
 
-    def __init__(self, message: str):
+    def __init__(self, message: Optional[str]):
         self.message = message
 
     def to_dict(self) -> dict:
         return {"type": "message", "message": self.message}
 
     @staticmethod
-    def try_from_dict(data: dict) -> Optional["PayloadChat"]:
-        if data.get("type") == "message":
-            return PayloadChat(message=data["message"])
-        return None
+    def from_fields(data: dict) -> "PayloadChat":
+        return PayloadChat(message=_field(data, "message", str, nullable=True))
+
 
+@register_payload("message-delta")
+class PayloadChatDelta(Payload):
+    """
+    A piece of a chat message still being generated, sent live and never persisted.
+    Deltas sharing a stream id are meant to be concatenated by the client until
+    the final PayloadChat arrives.
+    """
 
+    __slots__ = ("stream_id", "delta")
+
+    stream_id: str
+    delta: str
+
+    def __init__(self, stream_id: str, delta: str):
+        self.stream_id = stream_id
+        self.delta = delta
+
+    def to_dict(self) -> dict:
+        return {"type": "message-delta", "stream": self.stream_id, "delta": self.delta}
+
+    @staticmethod
+    def from_fields(data: dict) -> "PayloadChatDelta":
+        return PayloadChatDelta(
+            stream_id=_field(data, "stream", str), delta=_field(data, "delta", str)
+        )
+
+
+@register_payload("state", state="closed")
 class PayloadCloseChat(Payload):
+    __slots__ = ()
 
     def to_dict(self) -> dict:
         return {"type": "state", "state": "closed"}
 
     @staticmethod
-    def try_from_dict(data: dict) -> Optional["PayloadCloseChat"]:
-        if data.get("type") == "state" and data.get("state") == "closed":
-            return PayloadCloseChat()
-        return None
+    def from_fields(data: dict) -> "PayloadCloseChat":
+        return PayloadCloseChat()
 
 
+@register_payload("state", state="opened")
 class PayloadOpenChat(Payload):
+    __slots__ = ()
 
     def to_dict(self) -> dict:
         return {"type": "state", "state": "opened"}
@@ -56,25 +150,26 @@ class PayloadOpenChat(Payload):
         return True
 
     @staticmethod
-    def try_from_dict(data: dict) -> Optional["PayloadOpenChat"]:
-        if data.get("type") == "state" and data.get("state") == "opened":
-            return PayloadOpenChat()
-        return None
+    def from_fields(data: dict) -> "PayloadOpenChat":
+        return PayloadOpenChat()
 
 
+@register_payload("end")
 class PayloadEndSession(Payload):
+    __slots__ = ()
 
     def to_dict(self) -> dict:
         return {"type": "end"}
 
     @staticmethod
-    def try_from_dict(data: dict) -> Optional["PayloadEndSession"]:
-        if data.get("type") == "end":
-            return PayloadEndSession()
-        return None
+    def from_fields(data: dict) -> "PayloadEndSession":
+        return PayloadEndSession()
 
 
+@register_payload("dict")
 class PayloadDict(Payload):
+    __slots__ = ("data",)
+
     data: dict
 
     def __init__(self, data: dict):
@@ -84,13 +179,14 @@ class PayloadDict(Payload):
         return {"type": "dict", "data": self.data}
 
     @staticmethod
-    def try_from_dict(data: dict) -> Optional["PayloadDict"]:
-        if data.get("type") == "dict":
-            return PayloadDict(data["data"])
-        return None
+    def from_fields(data: dict) -> "PayloadDict":
+        return PayloadDict(_field(data, "data", dict))
 
 
+@register_payload("text-file")
 class PayloadTextFile(Payload):
+    __slots__ = ("name", "type", "content")
+
     name: str
     type: str
     content: str
@@ -107,11 +203,13 @@ class PayloadTextFile(Payload):
         }
 
     @staticmethod
-    def try_from_dict(data: dict) -> Optional["PayloadTextFile"]:
-        if data.get("type") == "text-file":
+    def from_fields(data: dict) -> "PayloadTextFile":
+        file = _field(data, "file", dict)
+        try:
             return PayloadTextFile(
-                name=data["file"]["name"],
-                content=data["file"]["content"],
-                type=data["file"]["type"],
+                name=_field(file, "name", str),
+                content=_field(file, "content", str),
+                type=_field(file, "type", str),
             )
-        return None
+        except PayloadDecodeError as e:
+            raise PayloadDecodeError(e.reason, field=f"file.{e.field}")
@@ -1,7 +1,9 @@
 from dataclasses import dataclass
-from typing import Callable
+from typing import Callable, Generator, Optional
+import uuid
 
 from yourapp.chat.payload import Payload
+from yourapp.chat.payloads import PayloadChatDelta
 from yourapp.sessions.messages import Message
 from yourapp.user import UserInfos
 
@@ -32,6 +34,23 @@ class SystemStateExecInputs:
         self.send_payload = send_payload
         self.expect_payload = expect_payload
 
+    def send_chat_stream(
+        self, deltas: Generator[str, None, Optional[str]]
+    ) -> Optional[str]:
+        """
+        Send each text delta of a stream such as `ask_llm_stream` as a
+        PayloadChatDelta as soon as it is produced, and return what the stream
+        returns: the assembled text, to be returned as a final PayloadChat, or
+        None if the LLM failed, as `ask_llm` does.
+        """
+        stream_id = uuid.uuid4().hex
+        while True:
+            try:
+                delta = next(deltas)
+            except StopIteration as stop:
+                return stop.value
+            self.send_payload(PayloadChatDelta(stream_id, delta))
+
 
 @dataclass
 class SystemState:
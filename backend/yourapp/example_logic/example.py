@@ -8,7 +8,7 @@ from yourapp.chat.payloads import (
 from yourapp.core.system_state import SystemState, SystemStateExecInputs
 from yourapp.core.system_states.registry import register_state
 from yourapp.sessions.messages import Message
-from yourapp.llms.ask import ask_llm, LLMModel, LLMProvider
+from yourapp.llms.ask import ask_llm_stream, LLMModel, LLMProvider
 
 
 # see yourapp.core.system_states.start_state
@@ -28,6 +28,7 @@ def execute_expand_state(
     It takes the last user input and asks an LLM to expand on it
     It sends back the answer as final payload which is persisted in the history
     In between it sends statuses payloads such as PayloadChat with "Thinking..." which is not persisted because not final.
+    The answer itself is streamed as PayloadChatDelta while it is generated, which is not persisted either.
     It transitions to a search state
     """
 
@@ -35,8 +36,9 @@ def execute_expand_state(
 
     inputs.send_payload(PayloadChat("Thinking how to expand your query..."))
 
-    result = ask_llm(
-        query=f"""
+    result = inputs.send_chat_stream(
+        ask_llm_stream(
+            query=f"""
 ```
 {prompt}
 ```
@@ -45,10 +47,11 @@ Add precision and context to the above internet search query
 
 Answer with only the modified query without text before or after:
 """,
-        system_prompt="You are a cool LLM. Cool LLMs do what they're asked for.",
-        provider=LLMProvider.MISTRAL,
-        model=LLMModel.MISTRAL_SMALL,
-        temperature=0.0,
+            system_prompt="You are a cool LLM. Cool LLMs do what they're asked for.",
+            provider=LLMProvider.MISTRAL,
+            model=LLMModel.MISTRAL_SMALL,
+            temperature=0.0,
+        )
     )
 
     return new_search_state(result), [
@@ -67,17 +70,19 @@ def execute_search_state(inputs: SystemStateExecInputs):
     """
     This state expects the previous state to have given it a query
     It asks an online LLM to search for it
-    It sends back the answer as a final payload which is persisted in the history
+    It streams the answer as it is generated, then sends it back as a final payload which is persisted in the history
     It transitions to a goodbye state
     """
     query = inputs.inner["query"]
 
     inputs.send_payload(PayloadChat("Searching..."))
 
-    results = ask_llm(
-        query=f"What is {query}?",
-        provider=LLMProvider.PPLX,
-        model=LLMModel.PPLX_SONAR_MD_ONLINE
+    results = inputs.send_chat_stream(
+        ask_llm_stream(
+            query=f"What is {query}?",
+            provider=LLMProvider.PPLX,
+            model=LLMModel.PPLX_SONAR_MD_ONLINE
+        )
     )
     return new_goodbye_state(), [PayloadChat(results)]
 
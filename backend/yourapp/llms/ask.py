@@ -1,83 +1,41 @@
-import csv
+import asyncio
 import datetime
 import hashlib
 import logging
-import os
-from typing import Optional
-from enum import Enum
-import anthropic
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Generator, Iterator, Optional
 from dotenv import load_dotenv
-from openai import OpenAI
-from groq import Groq
-from mistralai.client import MistralClient
 from mistralai.models.chat_completion import ChatMessage as MistralChatMessage
 
+from yourapp.llms.cache import LLMCache, LLMCacheEntry, get_llm_cache
+from yourapp.llms.clients import get_async_llm_client, get_llm_client
+from yourapp.llms.models import LLMModel, LLMProvider
+from yourapp.llms.stub import get_llm_stub
+
 load_dotenv()
 
 
-class LLMProvider(Enum):
-    ANTHROPIC = 0
-    PPLX = 1
-    GROQ = 2
-    MISTRAL = 3
-    OPENAI = 4
-
-
-class LLMModel(Enum):
-    CLAUDE_HAIKU = 0
-    CLAUDE_SONNET = 1
-    CLAUDE_OPUS = 2
-    PPLX_LLAMA3_70 = 3
-    PPLX_LLAMA3_8 = 4
-    PPLX_MIXTRAL_8x22 = 5
-    PPLX_SONAR_MD_ONLINE = 6
-    PPLX_SONAR_SM_ONLINE = 7
-    GROQ_LLAMA3_70 = 8
-    GROQ_LLAMA3_8 = 9
-    MISTRAL_SMALL = 10
-    MISTRAL_MEDIUM = 11
-    MISTRAL_LARGE = 12
-    MISTRAL_MIXTRAL_8x22 = 13
-    OPENAI_GPT_4_TURBO = 14
-    OPENAI_GPT_4_TURBO_PREVIEW = 15
-    OPENAI_GPT_4_VISION_PREVIEW = 16
-    OPENAI_GPT_3_5_TURBO = 17
-
-    def __str__(self):
-        """Return the string representation of the LLMModel."""
-        names = [
-            "claude-3-haiku-20240307",
-            "claude-3-sonnet-20240229",
-            "claude-3-opus-20240229",
-            "llama-3-70b-instruct",
-            "llama-3-8b-instruct",
-            "mixtral-8x22b-instruct",
-            "sonar-medium-online",
-            "sonar-small-online",
-            "llama3-70b-8192",
-            "llama3-8b-8192",
-            "mistral-small-latest",
-            "mistral-medium-latest",
-            "mistral-large-latest",
-            "open-mixtral-8x22b",
-            "gpt-4-turbo",
-            "gpt-4-turbo-preview",
-            "gpt-4-vision-preview",
-            "gpt-3.5-turbo"
-        ]
-        return names[self.value]
+@dataclass
+class LLMQuery:
+    """The arguments of one `ask_llm` call, for the functions sending many of them at once."""
+
+    query: str | list
+    system_prompt: str = ""
+    provider: LLMProvider = LLMProvider.ANTHROPIC
+    model: LLMModel = LLMModel.CLAUDE_HAIKU
+    max_tokens: int = 4000
+    temperature: float = 0.5
+    json_mode: bool = False
+    seed: Optional[int] = None
 
-    def is_coherent_with_provider(self, provider: LLMProvider) -> bool:
-        """Check if the LLMModel is coherent with the LLMProvider."""
-        if provider == LLMProvider.PPLX:
-            return self in [LLMModel.PPLX_LLAMA3_70, LLMModel.PPLX_LLAMA3_8, LLMModel.PPLX_MIXTRAL_8x22, LLMModel.PPLX_SONAR_MD_ONLINE, LLMModel.PPLX_SONAR_SM_ONLINE]
-        if provider == LLMProvider.GROQ:
-            return self in [LLMModel.GROQ_LLAMA3_70, LLMModel.GROQ_LLAMA3_8]
-        if provider == LLMProvider.MISTRAL:
-            return self in [LLMModel.MISTRAL_SMALL, LLMModel.MISTRAL_MEDIUM, LLMModel.MISTRAL_LARGE, LLMModel.MISTRAL_MIXTRAL_8x22]
-        if provider == LLMProvider.OPENAI:
-            return self in [LLMModel.OPENAI_GPT_4_TURBO, LLMModel.OPENAI_GPT_4_TURBO_PREVIEW, LLMModel.OPENAI_GPT_4_VISION_PREVIEW, LLMModel.OPENAI_GPT_3_5_TURBO]
-        return True
+
+@dataclass
+class LLMBatchResult:
+    response: Optional[str] = None
+    error: Optional[Exception] = None
+    cached: bool = False
 
 
 def ask_llm(
@@ -90,12 +48,14 @@ def ask_llm(
     temperature: float = 0.5,
     json_mode: bool = False,
     seed: Optional[int] = None,
+    cache: Optional[LLMCache] = None,
 ) -> Optional[str]:
     """Query LLMs.
 
     Please note that not all arguments work with all providers and models, especially system_prompt, max_tokens, json_mode, and temperature.
 
-    Use db_file_path to cache the queries in a CSV file.
+    Use db_file_path to cache the queries on disk: paths ending with .sqlite, .sqlite3 or .db use an indexed SQLite store, any other path an append-only CSV file.
+    Alternatively pass any `yourapp.llms.cache.LLMCache` as cache.
 
     Advanced example usages:
 
@@ -160,16 +120,327 @@ def ask_llm(
 
     assert model.is_coherent_with_provider(provider), f"Model {model} is not coherent with provider {provider}"
 
+    model, messages, seed = prepare_llm_call(query, system_prompt, provider, model, seed)
+
+    if cache is None and db_file_path is not None:
+        cache = get_llm_cache(db_file_path)
+
+    if cache is not None:
+        prompt_hash, params_hash, params_str = cache_keys(
+            query, system_prompt, seed, max_tokens, temperature
+        )
+        # Check if the exact same call is already cached
+        response = cache.get(prompt_hash, params_hash)
+        if response is not None:
+            return response
+
+    try:
+        response = complete_llm_call(
+            provider, model, messages, system_prompt, max_tokens, temperature, json_mode
+        )
+    except Exception as e:
+        logging.error(f"Error asking LLM: {e}")
+        return None
+
+    if cache is not None:
+        cache.put(
+            LLMCacheEntry(
+                timestamp=int(datetime.datetime.now().timestamp()),
+                model=str(model),
+                prompt_hash=prompt_hash,
+                params_hash=params_hash,
+                params=params_str,
+                prompt=str(system_prompt + "\n\n---\n\n" + prompt_to_str(query)),
+                answer=response,
+            )
+        )
+
+    return response
+
+
+def ask_llm_stream(
+    query: str | list,
+    system_prompt: str = "",
+    db_file_path: Optional[str] = None,
+    provider: LLMProvider = LLMProvider.ANTHROPIC,
+    model: LLMModel = LLMModel.CLAUDE_HAIKU,
+    max_tokens: int = 4000,
+    temperature: float = 0.5,
+    json_mode: bool = False,
+    seed: Optional[int] = None,
+    cache: Optional[LLMCache] = None,
+) -> Generator[str, None, Optional[str]]:
+    """Query LLMs like `ask_llm`, yielding the answer's text deltas as they are generated.
+
+    On a cache hit the whole answer is yielded at once.
+    The assembled answer is cached only once the stream completed, and is the generator's return value.
+    Errors are logged and end the stream early, in which case nothing is cached and None is returned like `ask_llm` does.
+
+    ```python
+    answer = ""
+    for delta in ask_llm_stream("What is the capital of France?", provider=LLMProvider.GROQ, model=LLMModel.GROQ_LLAMA3_8):
+        answer += delta
+        print(delta, end="")
+    ```
+    """
+
+    assert model.is_coherent_with_provider(provider), f"Model {model} is not coherent with provider {provider}"
+
+    model, messages, seed = prepare_llm_call(query, system_prompt, provider, model, seed)
+
+    if cache is None and db_file_path is not None:
+        cache = get_llm_cache(db_file_path)
+
+    if cache is not None:
+        prompt_hash, params_hash, params_str = cache_keys(
+            query, system_prompt, seed, max_tokens, temperature
+        )
+        response = cache.get(prompt_hash, params_hash)
+        if response is not None:
+            yield response
+            return response
+
+    deltas = []
+    try:
+        for delta in stream_llm_call(
+            provider, model, messages, system_prompt, max_tokens, temperature, json_mode
+        ):
+            deltas.append(delta)
+            yield delta
+    except Exception as e:
+        logging.error(f"Error streaming from LLM: {e}")
+        return None
+
+    response = "".join(deltas)
+    if cache is not None:
+        cache.put(
+            LLMCacheEntry(
+                timestamp=int(datetime.datetime.now().timestamp()),
+                model=str(model),
+                prompt_hash=prompt_hash,
+                params_hash=params_hash,
+                params=params_str,
+                prompt=str(system_prompt + "\n\n---\n\n" + prompt_to_str(query)),
+                answer=response,
+            )
+        )
+
+    return response
+
+
+async def ask_llm_async(
+    query: str | list,
+    system_prompt: str = "",
+    db_file_path: Optional[str] = None,
+    provider: LLMProvider = LLMProvider.ANTHROPIC,
+    model: LLMModel = LLMModel.CLAUDE_HAIKU,
+    max_tokens: int = 4000,
+    temperature: float = 0.5,
+    json_mode: bool = False,
+    seed: Optional[int] = None,
+    cache: Optional[LLMCache] = None,
+) -> Optional[str]:
+    """Query LLMs like `ask_llm`, using the providers' async clients."""
+
+    assert model.is_coherent_with_provider(provider), f"Model {model} is not coherent with provider {provider}"
+
+    model, messages, seed = prepare_llm_call(query, system_prompt, provider, model, seed)
+
+    if cache is None and db_file_path is not None:
+        cache = get_llm_cache(db_file_path)
+
+    if cache is not None:
+        prompt_hash, params_hash, params_str = cache_keys(
+            query, system_prompt, seed, max_tokens, temperature
+        )
+        # off the event loop, the first lookup of a CSV cache indexes its file
+        response = await asyncio.to_thread(cache.get, prompt_hash, params_hash)
+        if response is not None:
+            return response
+
+    try:
+        response = await complete_llm_call_async(
+            provider, model, messages, system_prompt, max_tokens, temperature, json_mode
+        )
+    except Exception as e:
+        logging.error(f"Error asking LLM: {e}")
+        return None
+
+    if cache is not None:
+        await asyncio.to_thread(
+            cache.put,
+            LLMCacheEntry(
+                timestamp=int(datetime.datetime.now().timestamp()),
+                model=str(model),
+                prompt_hash=prompt_hash,
+                params_hash=params_hash,
+                params=params_str,
+                prompt=str(system_prompt + "\n\n---\n\n" + prompt_to_str(query)),
+                answer=response,
+            ),
+        )
+
+    return response
+
+
+async def ask_many(
+    queries: list[LLMQuery],
+    db_file_path: Optional[str] = None,
+    cache: Optional[LLMCache] = None,
+    max_concurrency_per_provider: int = 4,
+) -> list[Optional[str]]:
+    """Run `ask_llm_async` for every query concurrently and return the answers in order.
+
+    At most `max_concurrency_per_provider` requests are in flight per provider.
+
+    From synchronous code, such as a system state, use `yourapp.llms.clients.run_on_llm_loop`:
+
+    ```python
+    expanded, searched = run_on_llm_loop(
+        ask_many([
+            LLMQuery(f"Expand on: {prompt}", provider=LLMProvider.MISTRAL, model=LLMModel.MISTRAL_SMALL),
+            LLMQuery(f"What is {prompt}?", provider=LLMProvider.PPLX, model=LLMModel.PPLX_SONAR_MD_ONLINE),
+        ])
+    )
+    ```
+    """
+    semaphores = defaultdict(lambda: asyncio.Semaphore(max_concurrency_per_provider))
+
+    async def ask_one(query: LLMQuery) -> Optional[str]:
+        async with semaphores[query.provider]:
+            return await ask_llm_async(
+                query=query.query,
+                system_prompt=query.system_prompt,
+                db_file_path=db_file_path,
+                provider=query.provider,
+                model=query.model,
+                max_tokens=query.max_tokens,
+                temperature=query.temperature,
+                json_mode=query.json_mode,
+                seed=query.seed,
+                cache=cache,
+            )
+
+    return await asyncio.gather(*[ask_one(query) for query in queries])
+
+
+def ask_llm_batch(
+    queries: list[LLMQuery],
+    db_file_path: Optional[str] = None,
+    cache: Optional[LLMCache] = None,
+    max_workers_per_provider: int = 4,
+) -> list[LLMBatchResult]:
+    """Answer many queries at once, for offline jobs.
+
+    Identical queries are sent only once, cache hits are resolved in a single
+    lookup and only the misses are sent, at most `max_workers_per_provider` at
+    a time per provider. New answers are written to the cache in one bulk append.
+
+    Results are in the order of `queries`. A failed query gets its exception in
+    `error` instead of stopping the batch.
+    """
+    if cache is None and db_file_path is not None:
+        cache = get_llm_cache(db_file_path)
+
+    results: list[Optional[LLMBatchResult]] = [None] * len(queries)
+    # identical calls, by provider, model, prompt and params
+    unique: dict[tuple, list[int]] = defaultdict(list)
+    calls: dict[tuple, tuple[LLMQuery, LLMModel, list, str, str, str]] = {}
+    for i, query in enumerate(queries):
+        try:
+            if not query.model.is_coherent_with_provider(query.provider):
+                raise ValueError(f"Model {query.model} is not coherent with provider {query.provider}")
+            model, messages, seed = prepare_llm_call(
+                query.query, query.system_prompt, query.provider, query.model, query.seed
+            )
+            prompt_hash, params_hash, params_str = cache_keys(
+                query.query, query.system_prompt, seed, query.max_tokens, query.temperature
+            )
+        except Exception as e:
+            results[i] = LLMBatchResult(error=e)
+            continue
+        key = (query.provider, model, query.json_mode, prompt_hash, params_hash)
+        unique[key].append(i)
+        calls.setdefault(key, (query, model, messages, prompt_hash, params_hash, params_str))
+
+    hits = {}
+    if cache is not None and len(calls) > 0:
+        hits = cache.get_many(
+            [(prompt_hash, params_hash) for _, _, _, prompt_hash, params_hash, _ in calls.values()]
+        )
+
+    misses = []
+    for key, (_, _, _, prompt_hash, params_hash, _) in calls.items():
+        answer = hits.get((prompt_hash, params_hash))
+        if answer is None:
+            misses.append(key)
+            continue
+        for i in unique[key]:
+            results[i] = LLMBatchResult(response=answer, cached=True)
+
+    executors = defaultdict(lambda: ThreadPoolExecutor(max_workers=max_workers_per_provider))
+    try:
+        futures = {}
+        for key in misses:
+            query, model, messages, _, _, _ = calls[key]
+            futures[key] = executors[query.provider].submit(
+                complete_llm_call,
+                query.provider,
+                model,
+                messages,
+                query.system_prompt,
+                query.max_tokens,
+                query.temperature,
+                query.json_mode,
+            )
+
+        entries = []
+        for key, future in futures.items():
+            query, model, _, prompt_hash, params_hash, params_str = calls[key]
+            try:
+                result = LLMBatchResult(response=future.result())
+            except Exception as e:
+                logging.error(f"Error asking LLM: {e}")
+                result = LLMBatchResult(error=e)
+            for i in unique[key]:
+                results[i] = result
+            if result.error is None:
+                entries.append(
+                    LLMCacheEntry(
+                        timestamp=int(datetime.datetime.now().timestamp()),
+                        model=str(model),
+                        prompt_hash=prompt_hash,
+                        params_hash=params_hash,
+                        params=params_str,
+                        prompt=str(query.system_prompt + "\n\n---\n\n" + prompt_to_str(query.query)),
+                        answer=result.response,
+                    )
+                )
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    if cache is not None and len(entries) > 0:
+        cache.put_many(entries)
+
+    return results
+
+
+def prepare_llm_call(
+    query: str | list,
+    system_prompt: str,
+    provider: LLMProvider,
+    model: LLMModel,
+    seed: Optional[int],
+) -> tuple[LLMModel, list, Optional[int]]:
+    """Return the model, the provider-specific messages and the seed to use for a call."""
     if provider == LLMProvider.ANTHROPIC:
-        client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
         if model is None:
             model = LLMModel.CLAUDE_HAIKU
         if seed is None:
             seed = 0
         messages = create_messages(query)
     elif provider == LLMProvider.MISTRAL:
-        api_key = os.environ["MISTRAL_API_KEY"]
-        client = MistralClient(api_key=api_key)
         messages = [MistralChatMessage(role="user", content=query)]
         if isinstance(query, list):
             messages = [
@@ -179,18 +450,10 @@ def ask_llm(
         if len(system_prompt) > 0:
             messages = [MistralChatMessage(role="system", content=system_prompt)] + messages
     elif provider == LLMProvider.OPENAI:
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         if model is None:
             model = LLMModel.OPENAI_GPT_3_5_TURBO
         messages = create_openai_messages(query, system_prompt)
-    else:
-        if provider == LLMProvider.PPLX:
-            llm = OpenAI(
-                api_key=os.getenv("PERPLEXITY_API_KEY"),
-                base_url="https://api.perplexity.ai",
-            )
-        else:  # provider == LLMProvider.GROQ
-            llm = Groq(api_key=os.getenv("GROQ_API_KEY"))
+    else:  # provider == LLMProvider.PPLX or provider == LLMProvider.GROQ
         if model is None:
             model = (
                 LLMModel.PPLX_LLAMA3_70
@@ -209,79 +472,139 @@ def ask_llm(
                 else:
                     messages.append({"role": "assistant", "content": message})
 
-    params_str = str(
-        {
-            "seed": seed,
-            "max_tokens": max_tokens,
-            "temperature": temperature,
-        }
-    )
-    prompt_hash = None
-    params_hash = None
-    if db_file_path is not None:
-        # Generate hashes for the prompt and params
-        prompt_hash = generate_hash(str(system_prompt + query))
-        params_hash = generate_hash(params_str)
-        # Check if the exact same call exists in the CSV file
-        response = read_from_csv(db_file_path, prompt_hash, params_hash)
-        if response is not None:
-            return response
-
-    try:
-        if provider == LLMProvider.ANTHROPIC:
-            message = client.messages.create(
-                model=str(model),
-                max_tokens=max_tokens,
-                temperature=temperature,
-                messages=messages,
-                system=system_prompt,
-            )
-            response = message.content[0].text
-        elif provider == LLMProvider.MISTRAL:
-            response = client.chat(
-                model=str(model),
-                messages=messages,
-                response_format={"type": "json_object"} if json_mode else None,
-                max_tokens=max_tokens,
-                temperature=temperature
-            )
-            response = response.choices[0].message.content
-        elif provider == LLMProvider.OPENAI:
-            response = client.chat.completions.create(
-                model=str(model),
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-            )
-            response = response.choices[0].message.content
-        else:
-            response = llm.chat.completions.create(
-                model=str(model),
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-            )
-            response = response.choices[0].message.content
-    except Exception as e:
-        logging.error(f"Error asking LLM: {e}")
-        return None
-
-    if db_file_path is not None:
-        # Write the new entry to the CSV file
-        timestamp = int(datetime.datetime.now().timestamp())
-        row = [
-            timestamp,
-            str(model),
-            prompt_hash,
-            params_hash,
-            params_str,
-            str(system_prompt + "\n\n---\n\n" + query),
-            response,
-            1,
-        ]
-        write_to_csv(db_file_path, row)
-
-    return response
+    return model, messages, seed
+
+
+def complete_llm_call(
+    provider: LLMProvider,
+    model: LLMModel,
+    messages: list,
+    system_prompt: str,
+    max_tokens: int,
+    temperature: float,
+    json_mode: bool,
+) -> str:
+    stub = get_llm_stub()
+    if stub is not None:
+        return stub.complete()
+    client = get_llm_client(provider)
+    if provider == LLMProvider.ANTHROPIC:
+        message = client.messages.create(
+            model=str(model),
+            max_tokens=max_tokens,
+            temperature=temperature,
+            messages=messages,
+            system=system_prompt,
+        )
+        return message.content[0].text
+    elif provider == LLMProvider.MISTRAL:
+        response = client.chat(
+            model=str(model),
+            messages=messages,
+            response_format={"type": "json_object"} if json_mode else None,
+            max_tokens=max_tokens,
+            temperature=temperature
+        )
+        return response.choices[0].message.content
+    else:
+        response = client.chat.completions.create(
+            model=str(model),
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        return response.choices[0].message.content
+
+
+def stream_llm_call(
+    provider: LLMProvider,
+    model: LLMModel,
+    messages: list,
+    system_prompt: str,
+    max_tokens: int,
+    temperature: float,
+    json_mode: bool,
+) -> Iterator[str]:
+    stub = get_llm_stub()
+    if stub is not None:
+        yield from stub.stream()
+        return
+    client = get_llm_client(provider)
+    if provider == LLMProvider.ANTHROPIC:
+        with client.messages.stream(
+            model=str(model),
+            max_tokens=max_tokens,
+            temperature=temperature,
+            messages=messages,
+            system=system_prompt,
+        ) as stream:
+            for delta in stream.text_stream:
+                yield delta
+    elif provider == LLMProvider.MISTRAL:
+        for chunk in client.chat_stream(
+            model=str(model),
+            messages=messages,
+            response_format={"type": "json_object"} if json_mode else None,
+            max_tokens=max_tokens,
+            temperature=temperature
+        ):
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+    else:
+        for chunk in client.chat.completions.create(
+            model=str(model),
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+        ):
+            if len(chunk.choices) == 0:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+
+async def complete_llm_call_async(
+    provider: LLMProvider,
+    model: LLMModel,
+    messages: list,
+    system_prompt: str,
+    max_tokens: int,
+    temperature: float,
+    json_mode: bool,
+) -> str:
+    stub = get_llm_stub()
+    if stub is not None:
+        return await stub.complete_async()
+    client = get_async_llm_client(provider)
+    if provider == LLMProvider.ANTHROPIC:
+        message = await client.messages.create(
+            model=str(model),
+            max_tokens=max_tokens,
+            temperature=temperature,
+            messages=messages,
+            system=system_prompt,
+        )
+        return message.content[0].text
+    elif provider == LLMProvider.MISTRAL:
+        response = await client.chat(
+            model=str(model),
+            messages=messages,
+            response_format={"type": "json_object"} if json_mode else None,
+            max_tokens=max_tokens,
+            temperature=temperature
+        )
+        return response.choices[0].message.content
+    else:
+        response = await client.chat.completions.create(
+            model=str(model),
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        return response.choices[0].message.content
 
 
 def create_messages(query):
@@ -368,25 +691,28 @@ def assistant(content: list | dict):
         return {"role": "assistant", "content": [content]}
 
 
-def write_to_csv(db_file_path: str, row: list):
-    """Write a row to the CSV file."""
-    with open(db_file_path, "a", newline="", encoding="utf-8") as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(row)
-
-
-def read_from_csv(
-    db_file_path: str, prompt_hash: str, params_hash: str
-) -> Optional[int]:
-    """Read the `answer` from the CSV file for the given `prompt_hash` and `params_hash`."""
-    answer = None
-    with open(db_file_path, "r", newline="", encoding="utf-8") as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            if row["prompt_hash"] == prompt_hash and row["params_hash"] == params_hash:
-                answer = row["answer"]
-                break
-    return answer
+def prompt_to_str(query: str | list) -> str:
+    return query if isinstance(query, str) else str(query)
+
+
+def cache_keys(
+    query: str | list,
+    system_prompt: str,
+    seed: Optional[int],
+    max_tokens: int,
+    temperature: float,
+) -> tuple[str, str, str]:
+    """Return the `(prompt_hash, params_hash, params_str)` identifying a call in the cache."""
+    params_str = str(
+        {
+            "seed": seed,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+        }
+    )
+    prompt_hash = generate_hash(str(system_prompt + prompt_to_str(query)))
+    params_hash = generate_hash(params_str)
+    return prompt_hash, params_hash, params_str
 
 
 def generate_hash(input_str: str) -> str:
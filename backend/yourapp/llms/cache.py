@@ -0,0 +1,317 @@
+import csv
+import io
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, Optional
+
+
+CSV_CACHE_FIELDS = [
+    "timestamp",
+    "model",
+    "prompt_hash",
+    "params_hash",
+    "params",
+    "prompt",
+    "answer",
+    "count",
+]
+
+SQLITE_CACHE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+
+
+@dataclass
+class LLMCacheEntry:
+    timestamp: int
+    model: str
+    prompt_hash: str
+    params_hash: str
+    params: str
+    prompt: str
+    answer: str
+
+    def to_row(self) -> list:
+        return [
+            self.timestamp,
+            self.model,
+            self.prompt_hash,
+            self.params_hash,
+            self.params,
+            self.prompt,
+            self.answer,
+            1,
+        ]
+
+
+class LLMCache(ABC):
+    @abstractmethod
+    def get(self, prompt_hash: str, params_hash: str) -> Optional[str]:
+        """
+        Return the cached answer for the given hashes.
+        Returns None if there is no such entry.
+        """
+        pass
+
+    @abstractmethod
+    def put(self, entry: LLMCacheEntry):
+        """
+        Store a new entry. If an entry already exists for the same hashes,
+        the first one wins, like with the original CSV lookup.
+        """
+        pass
+
+    def get_many(self, keys: list[tuple[str, str]]) -> dict[tuple[str, str], str]:
+        """Return the cached answers found for the given `(prompt_hash, params_hash)` keys."""
+        answers = {}
+        for key in keys:
+            answer = self.get(*key)
+            if answer is not None:
+                answers[key] = answer
+        return answers
+
+    def put_many(self, entries: list[LLMCacheEntry]):
+        for entry in entries:
+            self.put(entry)
+
+
+class CsvLLMCache(LLMCache):
+    """Append-only CSV log, indexed the first time it is used.
+
+    The index maps each key to the offset of its row in the file, answers are
+    read from disk when looked up, so that memory does not grow with them.
+    Prefer `SqliteLLMCache` for large caches, the index still holds every key.
+    """
+
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._index: Optional[dict[tuple[str, str], int]] = None
+        self._fields = CSV_CACHE_FIELDS
+        self._file: Optional[BinaryIO] = None
+
+    def _ensure_index(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            with open(self.path, "w", newline="", encoding="utf-8") as csvfile:
+                csv.writer(csvfile).writerow(CSV_CACHE_FIELDS)
+        self._file = open(self.path, "rb")
+        self._file.seek(0)
+        reader = csv.reader(_decoded_lines(self._file))
+        offset = self._file.tell()
+        first = next(reader, None)
+        if first is not None and "prompt_hash" in first:
+            self._fields = first
+            offset = self._file.tell()
+            first = next(reader, None)
+        row = first
+        while row is not None:
+            fields = dict(zip(self._fields, row))
+            self._index.setdefault((fields["prompt_hash"], fields["params_hash"]), offset)
+            offset = self._file.tell()
+            row = next(reader, None)
+
+    def _read_answer(self, offset: int) -> str:
+        # csv.reader pulls the lines of one row, however many its fields span
+        self._file.seek(offset)
+        row = next(csv.reader(_decoded_lines(self._file)))
+        return dict(zip(self._fields, row))["answer"]
+
+    def get(self, prompt_hash: str, params_hash: str) -> Optional[str]:
+        with self._lock:
+            self._ensure_index()
+            offset = self._index.get((prompt_hash, params_hash))
+            return None if offset is None else self._read_answer(offset)
+
+    def get_many(self, keys: list[tuple[str, str]]) -> dict[tuple[str, str], str]:
+        with self._lock:
+            self._ensure_index()
+            return {
+                key: self._read_answer(self._index[key]) for key in keys if key in self._index
+            }
+
+    def put(self, entry: LLMCacheEntry):
+        self.put_many([entry])
+
+    def put_many(self, entries: list[LLMCacheEntry]):
+        with self._lock:
+            self._ensure_index()
+            rows = io.StringIO(newline="")
+            writer = csv.writer(rows)
+            with open(self.path, "ab") as csvfile:
+                for entry in entries:
+                    offset = csvfile.tell()
+                    rows.seek(0)
+                    rows.truncate()
+                    writer.writerow(entry.to_row())
+                    csvfile.write(rows.getvalue().encode("utf-8"))
+                    self._index.setdefault((entry.prompt_hash, entry.params_hash), offset)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+
+
+def _decoded_lines(file: BinaryIO) -> Iterator[str]:
+    # line by line, so that file.tell() stays at the end of the last row read
+    while True:
+        line = file.readline()
+        if not line:
+            return
+        yield line.decode("utf-8")
+
+
+class SqliteLLMCache(LLMCache):
+    """SQLite store keyed on `(prompt_hash, params_hash)`."""
+
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                prompt_hash TEXT NOT NULL,
+                params_hash TEXT NOT NULL,
+                timestamp INTEGER NOT NULL,
+                model TEXT NOT NULL,
+                params TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                PRIMARY KEY (prompt_hash, params_hash)
+            ) WITHOUT ROWID
+            """
+        )
+        self._connection.commit()
+
+    def get(self, prompt_hash: str, params_hash: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT answer FROM llm_cache WHERE prompt_hash = ? AND params_hash = ?",
+                (prompt_hash, params_hash),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def get_many(self, keys: list[tuple[str, str]]) -> dict[tuple[str, str], str]:
+        answers = {}
+        keys = list(set(keys))
+        with self._lock:
+            # 2 variables per key, SQLite accepting at least 999 per statement
+            for i in range(0, len(keys), 400):
+                chunk = keys[i : i + 400]
+                rows = self._connection.execute(
+                    "SELECT prompt_hash, params_hash, answer FROM llm_cache WHERE (prompt_hash, params_hash) IN (VALUES "
+                    + ", ".join(["(?, ?)"] * len(chunk))
+                    + ")",
+                    [value for key in chunk for value in key],
+                ).fetchall()
+                for prompt_hash, params_hash, answer in rows:
+                    answers[(prompt_hash, params_hash)] = answer
+        return answers
+
+    def put(self, entry: LLMCacheEntry):
+        self.put_many([entry])
+
+    def put_many(self, entries: list[LLMCacheEntry]):
+        with self._lock:
+            self._connection.executemany(
+                """
+                INSERT OR IGNORE INTO llm_cache
+                (prompt_hash, params_hash, timestamp, model, params, prompt, answer)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        entry.prompt_hash,
+                        entry.params_hash,
+                        entry.timestamp,
+                        entry.model,
+                        entry.params,
+                        entry.prompt,
+                        entry.answer,
+                    )
+                    for entry in entries
+                ],
+            )
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_CACHES: dict[str, LLMCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_llm_cache(db_file_path: str) -> LLMCache:
+    """
+    Return the process-wide cache for `db_file_path`.
+    Paths ending with .sqlite, .sqlite3 or .db use SQLite, anything else the CSV log.
+    """
+    path = os.path.abspath(db_file_path)
+    with _CACHES_LOCK:
+        cache = _CACHES.get(path)
+        if cache is None:
+            if path.endswith(SQLITE_CACHE_SUFFIXES):
+                cache = SqliteLLMCache(path)
+            else:
+                cache = CsvLLMCache(path)
+            _CACHES[path] = cache
+        return cache
+
+
+def read_csv_cache_rows(csv_path: str):
+    """Iterate over the rows of a CSV cache, with or without a header line."""
+    with open(csv_path, "r", newline="", encoding="utf-8") as csvfile:
+        reader = csv.reader(csvfile)
+        first = next(reader, None)
+        if first is None:
+            return
+        fields = CSV_CACHE_FIELDS
+        if "prompt_hash" in first:
+            fields = first
+        else:
+            yield dict(zip(fields, first))
+        for row in reader:
+            yield dict(zip(fields, row))
+
+
+def import_csv_cache(csv_path: str, sqlite_path: str, batch_size: int = 10000) -> int:
+    """Copy every row of a CSV cache into a SQLite cache. Returns the number of rows read."""
+    cache = SqliteLLMCache(sqlite_path)
+    count = 0
+    batch = []
+    try:
+        for row in read_csv_cache_rows(csv_path):
+            batch.append(
+                LLMCacheEntry(
+                    timestamp=int(row.get("timestamp") or 0),
+                    model=row.get("model", ""),
+                    prompt_hash=row["prompt_hash"],
+                    params_hash=row["params_hash"],
+                    params=row.get("params", ""),
+                    prompt=row.get("prompt", ""),
+                    answer=row["answer"],
+                )
+            )
+            if len(batch) >= batch_size:
+                cache.put_many(batch)
+                count += len(batch)
+                batch = []
+        if len(batch) > 0:
+            cache.put_many(batch)
+            count += len(batch)
+    finally:
+        cache.close()
+    return count
@@ -0,0 +1,277 @@
+import asyncio
+import os
+import threading
+import weakref
+from dataclasses import dataclass, field
+from typing import Any, Coroutine, Optional, TypeVar
+import anthropic
+import httpx
+from openai import AsyncOpenAI, OpenAI
+from groq import AsyncGroq, Groq
+from mistralai.async_client import MistralAsyncClient
+from mistralai.client import MistralClient
+
+from yourapp.llms.models import LLMProvider
+
+
+PROVIDERS_API_KEY_ENV = {
+    LLMProvider.ANTHROPIC: "ANTHROPIC_API_KEY",
+    LLMProvider.PPLX: "PERPLEXITY_API_KEY",
+    LLMProvider.GROQ: "GROQ_API_KEY",
+    LLMProvider.MISTRAL: "MISTRAL_API_KEY",
+    LLMProvider.OPENAI: "OPENAI_API_KEY",
+}
+
+PROVIDERS_BASE_URL = {
+    LLMProvider.PPLX: "https://api.perplexity.ai",
+}
+
+
+@dataclass
+class LLMClientsConfig:
+    max_connections: int = field(
+        default_factory=lambda: int(os.getenv("LLM_POOL_SIZE", "20"))
+    )
+    max_keepalive_connections: int = field(
+        default_factory=lambda: int(os.getenv("LLM_POOL_SIZE", "20"))
+    )
+    keepalive_expiry: float = 60.0
+    timeout: float = field(
+        default_factory=lambda: float(os.getenv("LLM_TIMEOUT", "120"))
+    )
+    connect_timeout: float = 10.0
+    max_retries: int = 2
+
+
+_CONFIG: Optional[LLMClientsConfig] = None
+_CLIENTS: dict[tuple[LLMProvider, Optional[str], Optional[str]], Any] = {}
+_CLIENTS_LOCK = threading.Lock()
+_ASYNC_CLIENTS: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, dict[tuple[LLMProvider, Optional[str], Optional[str]], Any]
+] = weakref.WeakKeyDictionary()
+_LLM_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+T = TypeVar("T")
+
+
+def configure_llm_clients(**kwargs):
+    """
+    Change the pooling options of the LLM clients (see `LLMClientsConfig`).
+    Clients are rebuilt lazily with the new options. The former ones are closed
+    once the requests they may be serving had time to end, the async ones on
+    their own event loop.
+    """
+    global _CONFIG
+    with _CLIENTS_LOCK:
+        base = _CONFIG if _CONFIG is not None else LLMClientsConfig()
+        _CONFIG = LLMClientsConfig(**{**base.__dict__, **kwargs})
+        clients = list(_CLIENTS.values())
+        async_clients = [
+            (loop, list(loop_clients.values()))
+            for loop, loop_clients in _ASYNC_CLIENTS.items()
+        ]
+        _CLIENTS.clear()
+        _ASYNC_CLIENTS.clear()
+
+    if len(clients) > 0 or len(async_clients) > 0:
+        # a request lasts at most the timeout of each of its attempts
+        timer = threading.Timer(
+            base.timeout * (base.max_retries + 1),
+            _close_clients,
+            (clients, async_clients),
+        )
+        timer.daemon = True
+        timer.start()
+
+
+def _close_clients(
+    clients: list[Any], async_clients: list[tuple[asyncio.AbstractEventLoop, list[Any]]]
+):
+    for client in clients:
+        # MistralClient has no close method
+        if hasattr(client, "close"):
+            client.close()
+    for loop, loop_clients in async_clients:
+        # the connections of a stopped loop cannot be closed anymore
+        if not loop.is_running():
+            continue
+        for client in loop_clients:
+            try:
+                asyncio.run_coroutine_threadsafe(client.close(), loop)
+            except RuntimeError:
+                break  # the loop closed meanwhile
+
+
+def get_llm_client(
+    provider: LLMProvider,
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = None,
+):
+    """
+    Return the process-wide client for `(provider, api_key, base_url)`, building it on first use.
+    The API key and base URL default to the provider's environment variable and endpoint.
+
+    The returned clients are thread-safe and keep their HTTP connections alive between calls.
+    """
+    global _CONFIG
+    if api_key is None:
+        api_key = os.getenv(PROVIDERS_API_KEY_ENV[provider])
+    if base_url is None:
+        base_url = PROVIDERS_BASE_URL.get(provider)
+
+    key = (provider, api_key, base_url)
+    client = _CLIENTS.get(key)
+    if client is not None:
+        return client
+
+    with _CLIENTS_LOCK:
+        if _CONFIG is None:
+            _CONFIG = LLMClientsConfig()
+        client = _CLIENTS.get(key)
+        if client is None:
+            client = _build_client(provider, api_key, base_url, _CONFIG)
+            _CLIENTS[key] = client
+        return client
+
+
+def get_async_llm_client(
+    provider: LLMProvider,
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = None,
+):
+    """
+    Async counterpart of `get_llm_client`, to be called from a coroutine.
+    Async HTTP connections cannot be shared across event loops, so clients are kept per running loop.
+    """
+    global _CONFIG
+    if api_key is None:
+        api_key = os.getenv(PROVIDERS_API_KEY_ENV[provider])
+    if base_url is None:
+        base_url = PROVIDERS_BASE_URL.get(provider)
+
+    loop = asyncio.get_running_loop()
+    key = (provider, api_key, base_url)
+    with _CLIENTS_LOCK:
+        if _CONFIG is None:
+            _CONFIG = LLMClientsConfig()
+        clients = _ASYNC_CLIENTS.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            client = _build_async_client(provider, api_key, base_url, _CONFIG)
+            clients[key] = client
+        return client
+
+
+def run_on_llm_loop(coroutine: Coroutine[Any, Any, T]) -> T:
+    """
+    Run a coroutine on a process-wide event loop and block until it is done.
+
+    Meant for synchronous code such as system states: unlike `asyncio.run`,
+    the loop, hence its async clients and their connections, outlive the call.
+    """
+    global _LLM_LOOP
+    with _CLIENTS_LOCK:
+        if _LLM_LOOP is None:
+            _LLM_LOOP = asyncio.new_event_loop()
+            threading.Thread(
+                target=_LLM_LOOP.run_forever, name="llm-loop", daemon=True
+            ).start()
+    return asyncio.run_coroutine_threadsafe(coroutine, _LLM_LOOP).result()
+
+
+def _build_http_client(config: LLMClientsConfig) -> httpx.Client:
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(config.timeout, connect=config.connect_timeout),
+        follow_redirects=True,
+    )
+
+
+def _build_client(
+    provider: LLMProvider,
+    api_key: Optional[str],
+    base_url: Optional[str],
+    config: LLMClientsConfig,
+):
+    if provider == LLMProvider.ANTHROPIC:
+        return anthropic.Anthropic(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=config.max_retries,
+            http_client=_build_http_client(config),
+        )
+    if provider == LLMProvider.MISTRAL:
+        # MistralClient builds its own pooled httpx client and does not expose its limits
+        return MistralClient(
+            api_key=api_key,
+            endpoint=base_url or "https://api.mistral.ai",
+            max_retries=config.max_retries,
+            timeout=int(config.timeout),
+        )
+    if provider == LLMProvider.GROQ:
+        return Groq(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=config.max_retries,
+            http_client=_build_http_client(config),
+        )
+    # LLMProvider.OPENAI and LLMProvider.PPLX
+    return OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        max_retries=config.max_retries,
+        http_client=_build_http_client(config),
+    )
+
+
+def _build_async_http_client(config: LLMClientsConfig) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(config.timeout, connect=config.connect_timeout),
+        follow_redirects=True,
+    )
+
+
+def _build_async_client(
+    provider: LLMProvider,
+    api_key: Optional[str],
+    base_url: Optional[str],
+    config: LLMClientsConfig,
+):
+    if provider == LLMProvider.ANTHROPIC:
+        return anthropic.AsyncAnthropic(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=config.max_retries,
+            http_client=_build_async_http_client(config),
+        )
+    if provider == LLMProvider.MISTRAL:
+        return MistralAsyncClient(
+            api_key=api_key,
+            endpoint=base_url or "https://api.mistral.ai",
+            max_retries=config.max_retries,
+            timeout=int(config.timeout),
+            max_concurrent_requests=config.max_connections,
+        )
+    if provider == LLMProvider.GROQ:
+        return AsyncGroq(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=config.max_retries,
+            http_client=_build_async_http_client(config),
+        )
+    # LLMProvider.OPENAI and LLMProvider.PPLX
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        max_retries=config.max_retries,
+        http_client=_build_async_http_client(config),
+    )
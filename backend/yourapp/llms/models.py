@@ -0,0 +1,66 @@
+from enum import Enum
+
+
+class LLMProvider(Enum):
+    ANTHROPIC = 0
+    PPLX = 1
+    GROQ = 2
+    MISTRAL = 3
+    OPENAI = 4
+
+
+class LLMModel(Enum):
+    CLAUDE_HAIKU = 0
+    CLAUDE_SONNET = 1
+    CLAUDE_OPUS = 2
+    PPLX_LLAMA3_70 = 3
+    PPLX_LLAMA3_8 = 4
+    PPLX_MIXTRAL_8x22 = 5
+    PPLX_SONAR_MD_ONLINE = 6
+    PPLX_SONAR_SM_ONLINE = 7
+    GROQ_LLAMA3_70 = 8
+    GROQ_LLAMA3_8 = 9
+    MISTRAL_SMALL = 10
+    MISTRAL_MEDIUM = 11
+    MISTRAL_LARGE = 12
+    MISTRAL_MIXTRAL_8x22 = 13
+    OPENAI_GPT_4_TURBO = 14
+    OPENAI_GPT_4_TURBO_PREVIEW = 15
+    OPENAI_GPT_4_VISION_PREVIEW = 16
+    OPENAI_GPT_3_5_TURBO = 17
+
+    def __str__(self):
+        """Return the string representation of the LLMModel."""
+        names = [
+            "claude-3-haiku-20240307",
+            "claude-3-sonnet-20240229",
+            "claude-3-opus-20240229",
+            "llama-3-70b-instruct",
+            "llama-3-8b-instruct",
+            "mixtral-8x22b-instruct",
+            "sonar-medium-online",
+            "sonar-small-online",
+            "llama3-70b-8192",
+            "llama3-8b-8192",
+            "mistral-small-latest",
+            "mistral-medium-latest",
+            "mistral-large-latest",
+            "open-mixtral-8x22b",
+            "gpt-4-turbo",
+            "gpt-4-turbo-preview",
+            "gpt-4-vision-preview",
+            "gpt-3.5-turbo"
+        ]
+        return names[self.value]
+
+    def is_coherent_with_provider(self, provider: LLMProvider) -> bool:
+        """Check if the LLMModel is coherent with the LLMProvider."""
+        if provider == LLMProvider.PPLX:
+            return self in [LLMModel.PPLX_LLAMA3_70, LLMModel.PPLX_LLAMA3_8, LLMModel.PPLX_MIXTRAL_8x22, LLMModel.PPLX_SONAR_MD_ONLINE, LLMModel.PPLX_SONAR_SM_ONLINE]
+        if provider == LLMProvider.GROQ:
+            return self in [LLMModel.GROQ_LLAMA3_70, LLMModel.GROQ_LLAMA3_8]
+        if provider == LLMProvider.MISTRAL:
+            return self in [LLMModel.MISTRAL_SMALL, LLMModel.MISTRAL_MEDIUM, LLMModel.MISTRAL_LARGE, LLMModel.MISTRAL_MIXTRAL_8x22]
+        if provider == LLMProvider.OPENAI:
+            return self in [LLMModel.OPENAI_GPT_4_TURBO, LLMModel.OPENAI_GPT_4_TURBO_PREVIEW, LLMModel.OPENAI_GPT_4_VISION_PREVIEW, LLMModel.OPENAI_GPT_3_5_TURBO]
+        return True
@@ -0,0 +1,53 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+
+@dataclass
+class LLMStub:
+    """
+    Fake LLM answering every call with generated text, for load tests.
+
+    Enabled by setting LLM_STUB=1 in the environment: every provider then waits
+    `latency` seconds before the first token and `token_interval` seconds
+    between each of its `tokens` tokens, without any network call.
+    """
+
+    latency: float = field(
+        default_factory=lambda: float(os.getenv("LLM_STUB_LATENCY", "0.5"))
+    )
+    tokens: int = field(
+        default_factory=lambda: int(os.getenv("LLM_STUB_TOKENS", "50"))
+    )
+    token_interval: float = field(
+        default_factory=lambda: float(os.getenv("LLM_STUB_TOKEN_INTERVAL", "0.02"))
+    )
+
+    def stream(self) -> Iterator[str]:
+        time.sleep(self.latency)
+        for i in range(self.tokens):
+            if i > 0:
+                time.sleep(self.token_interval)
+            yield f"token{i} "
+
+    def complete(self) -> str:
+        return "".join(self.stream())
+
+    async def complete_async(self) -> str:
+        await asyncio.sleep(self.latency + self.token_interval * max(self.tokens - 1, 0))
+        return "".join(f"token{i} " for i in range(self.tokens))
+
+
+_STUB: Optional[LLMStub] = None
+
+
+def get_llm_stub() -> Optional[LLMStub]:
+    """Return the stub to answer LLM calls with, or None to call the real providers."""
+    global _STUB
+    if os.getenv("LLM_STUB", "") not in ("1", "true"):
+        return None
+    if _STUB is None:
+        _STUB = LLMStub()
+    return _STUB
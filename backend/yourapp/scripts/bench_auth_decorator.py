@@ -0,0 +1,66 @@
+import argparse
+import os
+import time
+import jwt
+from dotenv import load_dotenv
+from flask import Flask
+
+from yourapp.auth import get_tokens_cache, get_user_clients_cache
+from yourapp.auth.controller import init_auth_routes
+
+
+def time_calls(app: Flask, handler, token: str, n: int, before_each=None) -> float:
+    """Average microseconds per call of the decorated `handler` for a request carrying `token`."""
+    with app.test_request_context(f"/?token={token}"):
+        total = 0.0
+        for _ in range(n):
+            if before_each is not None:
+                before_each()
+            start = time.perf_counter()
+            handler()
+            total += time.perf_counter() - start
+    return total / n * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time the overhead of the authentication decorators with and without their caches"
+    )
+    parser.add_argument("-n", type=int, default=20000, help="Calls per measure")
+    parser.add_argument(
+        "--email", type=str, help="Also time supbase_user_client_required, signing in as this user"
+    )
+    parser.add_argument("--password", type=str)
+    args = parser.parse_args()
+
+    load_dotenv()
+    app_secret = os.getenv("APP_SECRET") or "bench-secret-bench-secret-bench-secret"
+    app = Flask(__name__)
+    login_required, supbase_user_client_required = init_auth_routes(
+        app,
+        app_secret,
+        os.getenv("SUPABASE_PROJECT_URL"),
+        os.getenv("SUPABASE_PUBLIC_API_KEY"),
+        admin_client=None,
+    )
+
+    token = jwt.encode(
+        {
+            "id": "00000000-0000-0000-0000-000000000000",
+            "credentials": {"email": args.email, "password": args.password},
+        },
+        app_secret,
+        algorithm="HS256",
+    )
+
+    handler = login_required(lambda user_id: user_id)
+    uncached = time_calls(app, handler, token, args.n, get_tokens_cache().clear)
+    cached = time_calls(app, handler, token, args.n)
+    print(f"login_required                {uncached:>10.1f}us uncached {cached:>10.1f}us cached")
+
+    if args.email is not None:
+        handler = supbase_user_client_required(lambda user_id, client: client)
+        n = 5
+        uncached = time_calls(app, handler, token, n, get_user_clients_cache().clear)
+        cached = time_calls(app, handler, token, args.n)
+        print(f"supbase_user_client_required  {uncached:>10.1f}us uncached {cached:>10.1f}us cached")
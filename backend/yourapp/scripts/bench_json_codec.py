@@ -0,0 +1,106 @@
+import argparse
+import json
+import time
+from datetime import datetime, UTC
+
+from yourapp.scripts.bench_payload_decoding import best_of, mixed_payloads
+from yourapp.sessions.messages import Message, message_from_row, messages_to_json
+from yourapp.utils import codec
+
+
+def message_to_dict_stdlib(message: Message) -> dict:
+    """The former `Message.to_dict`, building an isoformat string per message."""
+    return {
+        "id": message.id,
+        "payload": message.payload,
+        "created_at": message.created_at.isoformat(),
+        "is_system": message.is_system,
+    }
+
+
+def history_rows(length: int, seed: int) -> list[dict]:
+    """Rows of `sessions messages` as returned by the database."""
+    return [
+        {
+            "id": i,
+            "payload_json": json.dumps(payload),
+            "created_at": datetime.now(UTC).isoformat(),
+            "is_system": i % 2 == 0,
+        }
+        for i, payload in enumerate(mixed_payloads(length, seed))
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time JSON encoding and decoding of message histories: stdlib, codec and raw payloads spliced in"
+    )
+    parser.add_argument("--sessions", type=int, default=100, help="Histories per measure")
+    parser.add_argument("--length", type=int, default=200, help="Messages per history")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    histories_rows = [history_rows(args.length, seed) for seed in range(args.sessions)]
+    # decoded as they used to be, and raw as loaded now
+    histories = [[message_from_row(row) for row in rows] for rows in histories_rows]
+    for history in histories:
+        for message in history:
+            message.payload
+    raw_histories = [[message_from_row(row) for row in rows] for rows in histories_rows]
+
+    def load_stdlib():
+        for rows in histories_rows:
+            [json.loads(row["payload_json"]) for row in rows]
+
+    def load_codec():
+        for rows in histories_rows:
+            [codec.loads(row["payload_json"]) for row in rows]
+
+    def send_history_stdlib():
+        for history in histories:
+            json.dumps({"messages": [message_to_dict_stdlib(m) for m in history]})
+
+    def send_history_codec():
+        for history in histories:
+            codec.dumps({"messages": history})
+
+    def send_history_spliced():
+        for history in raw_histories:
+            messages_to_json(history)
+
+    def send_frames_stdlib():
+        for history in histories:
+            [json.dumps(message_to_dict_stdlib(m)) for m in history]
+
+    def send_frames_codec():
+        for history in histories:
+            [codec.dumps(m) for m in history]
+
+    def send_frames_spliced():
+        for history in raw_histories:
+            [m.to_json() for m in history]
+
+    def persist_stdlib():
+        for history in histories:
+            [json.dumps(m.payload) for m in history]
+
+    def persist_codec():
+        for history in histories:
+            [codec.dumps(m.payload) for m in history]
+
+    measures = {
+        "load rows": (load_stdlib, load_codec, None),
+        "send history": (send_history_stdlib, send_history_codec, send_history_spliced),
+        "send frames": (send_frames_stdlib, send_frames_codec, send_frames_spliced),
+        "persist payloads": (persist_stdlib, persist_codec, None),
+    }
+
+    n = args.sessions * args.length
+    print(f"{args.sessions} histories of {args.length} messages, codec backend: {codec.BACKEND}")
+    print(f"{'':<17} {'stdlib':>12} {'codec':>12} {'raw spliced':>12}")
+    for name, variants in measures.items():
+        timings = [
+            f"{best_of(args.repeat, f) / n * 1e9:>10.0f}ns" if f is not None else f"{'-':>12}"
+            for f in variants
+        ]
+        print(f"{name:<17} {' '.join(timings)} per message")
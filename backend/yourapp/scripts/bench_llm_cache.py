@@ -0,0 +1,102 @@
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+
+from yourapp.llms.ask import generate_hash
+from yourapp.llms.cache import (
+    CSV_CACHE_FIELDS,
+    CsvLLMCache,
+    LLMCacheEntry,
+    import_csv_cache,
+    SqliteLLMCache,
+)
+
+
+def read_from_csv(csv_path: str, prompt_hash: str, params_hash: str):
+    """The former lookup: a linear scan of the CSV file."""
+    with open(csv_path, "r", newline="", encoding="utf-8") as csvfile:
+        for row in csv.DictReader(csvfile):
+            if row["prompt_hash"] == prompt_hash and row["params_hash"] == params_hash:
+                return row["answer"]
+    return None
+
+
+def write_csv_cache(path: str, rows: int) -> list[tuple[str, str]]:
+    keys = []
+    with open(path, "w", newline="", encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(CSV_CACHE_FIELDS)
+        for i in range(rows):
+            prompt_hash = generate_hash(f"prompt {i}")
+            params_hash = generate_hash("params")
+            keys.append((prompt_hash, params_hash))
+            writer.writerow(
+                LLMCacheEntry(
+                    timestamp=0,
+                    model="bench",
+                    prompt_hash=prompt_hash,
+                    params_hash=params_hash,
+                    params="{}",
+                    prompt=f"prompt {i}",
+                    answer=f"answer {i} " + "lorem ipsum " * 20,
+                ).to_row()
+            )
+    return keys
+
+
+def time_lookups(get, keys: list[tuple[str, str]]) -> float:
+    """Return the mean hit latency in microseconds."""
+    start = time.perf_counter()
+    for prompt_hash, params_hash in keys:
+        assert get(prompt_hash, params_hash) is not None
+    return (time.perf_counter() - start) / len(keys) * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare ask_llm cache hit latency")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument(
+        "--linear-lookups",
+        type=int,
+        default=20,
+        help="Lookups for the legacy linear CSV scan, which is slow on big files",
+    )
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'csv scan':>12} {'csv index':>12} {'sqlite':>12} {'index build':>12}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, "cache.csv")
+            sqlite_path = os.path.join(tmp, "cache.sqlite")
+            keys = write_csv_cache(csv_path, size)
+            import_csv_cache(csv_path, sqlite_path)
+
+            linear_keys = random.choices(keys, k=args.linear_lookups)
+            lookup_keys = random.choices(keys, k=args.lookups)
+
+            linear = time_lookups(
+                lambda prompt_hash, params_hash: read_from_csv(
+                    csv_path, prompt_hash, params_hash
+                ),
+                linear_keys,
+            )
+
+            csv_cache = CsvLLMCache(csv_path)
+            start = time.perf_counter()
+            csv_cache.get(*keys[0])
+            build = time.perf_counter() - start
+            indexed = time_lookups(csv_cache.get, lookup_keys)
+
+            sqlite_cache = SqliteLLMCache(sqlite_path)
+            sqlite = time_lookups(sqlite_cache.get, lookup_keys)
+            sqlite_cache.close()
+
+            print(
+                f"{size:>10} {linear:>10.0f}us {indexed:>10.1f}us {sqlite:>10.1f}us {build:>11.2f}s"
+            )
@@ -0,0 +1,93 @@
+import argparse
+import random
+import time
+
+from yourapp.chat.payloads import (
+    PayloadChat,
+    PayloadChatDelta,
+    PayloadCloseChat,
+    PayloadDict,
+    PayloadEndSession,
+    PayloadOpenChat,
+    PayloadTextFile,
+    payload_from_dict,
+    payloads_from_dicts,
+)
+
+
+def payload_from_dict_chained(data: dict):
+    """The former implementation: an if/elif chain, each branch re-checking the type."""
+
+    def check(cls, matches: bool):
+        return cls.from_fields(data) if matches else None
+
+    payload_type = data.get("type")
+    if payload_type == "message":
+        return check(PayloadChat, data.get("type") == "message")
+    elif payload_type == "message-delta":
+        return check(PayloadChatDelta, data.get("type") == "message-delta")
+    elif payload_type == "state" and data.get("state") == "closed":
+        return check(
+            PayloadCloseChat, data.get("type") == "state" and data.get("state") == "closed"
+        )
+    elif payload_type == "state" and data.get("state") == "opened":
+        return check(
+            PayloadOpenChat, data.get("type") == "state" and data.get("state") == "opened"
+        )
+    elif payload_type == "end":
+        return check(PayloadEndSession, data.get("type") == "end")
+    elif payload_type == "dict":
+        return check(PayloadDict, data.get("type") == "dict")
+    elif payload_type == "text-file":
+        return check(PayloadTextFile, data.get("type") == "text-file")
+    raise ValueError(f"Unknown payload type: {data['type']}")
+
+
+def mixed_payloads(n: int, seed: int = 0) -> list[dict]:
+    """Chat-like traffic: mostly messages and deltas, some states, files and dicts."""
+    samples = [
+        (PayloadChat("bench message " + "lorem " * 20).to_dict(), 40),
+        (PayloadChatDelta("0" * 32, "lorem ").to_dict(), 30),
+        (PayloadOpenChat().to_dict(), 10),
+        (PayloadCloseChat().to_dict(), 5),
+        (PayloadEndSession().to_dict(), 5),
+        (PayloadDict({"results": [1, 2, 3]}).to_dict(), 5),
+        (PayloadTextFile("notes.txt", "text/plain", "lorem " * 50).to_dict(), 5),
+    ]
+    rng = random.Random(seed)
+    return [
+        dict(payload)
+        for payload in rng.choices(
+            [payload for payload, _ in samples], [weight for _, weight in samples], k=n
+        )
+    ]
+
+
+def best_of(repeat: int, f) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the decoding of mixed chat payloads")
+    parser.add_argument("-n", type=int, default=100000, help="Payloads per measure")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    payloads = mixed_payloads(args.n)
+
+    timings = {
+        "if/elif chain": best_of(
+            args.repeat, lambda: [payload_from_dict_chained(p) for p in payloads]
+        ),
+        "registry": best_of(args.repeat, lambda: [payload_from_dict(p) for p in payloads]),
+        "registry bulk": best_of(args.repeat, lambda: payloads_from_dicts(payloads)),
+    }
+
+    print(f"{args.n} payloads")
+    for name, timing in timings.items():
+        print(f"{name:<15} {timing * 1000:>8.1f}ms {timing / args.n * 1e9:>8.0f}ns/payload")
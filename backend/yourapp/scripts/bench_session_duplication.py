@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import time
+from dotenv import load_dotenv
+from supabase import create_client, Client as SupabaseClient
+
+from yourapp.sessions import add_session, duplicate_session
+from yourapp.sessions.messages import add_multiple_messages
+
+
+def duplicate_session_client_side(client: SupabaseClient, session_id: int) -> int:
+    """The former implementation: every message goes through Python and back."""
+    session = client.table("sessions").select("*").eq("id", session_id).execute().data[0]
+    new_session_id = (
+        client.table("sessions")
+        .insert(
+            {
+                "owner_id": session["owner_id"],
+                "title": session["title"] + " 1",
+                "system_state_json": session["system_state_json"],
+                "user_state_json": session["user_state_json"],
+            }
+        )
+        .execute()
+        .data[0]["id"]
+    )
+    rows = (
+        client.table("sessions messages").select("*").eq("session_id", session_id).execute().data
+    )
+    payloads = [json.loads(row["payload_json"]) for row in rows]
+    if len(rows) > 0:
+        inserted = (
+            client.table("sessions messages")
+            .insert(
+                [
+                    {
+                        "session_id": new_session_id,
+                        "payload_json": json.dumps(payload),
+                        "is_system": row["is_system"],
+                    }
+                    for row, payload in zip(rows, payloads)
+                ]
+            )
+            .execute()
+            .data
+        )
+        [json.loads(row["payload_json"]) for row in inserted]
+    return new_session_id
+
+
+def delete_sessions(client: SupabaseClient, session_ids: list[int]):
+    client.table("sessions messages").delete().in_("session_id", session_ids).execute()
+    client.table("sessions").delete().in_("id", session_ids).execute()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time session duplication against history length on the configured Supabase project"
+    )
+    parser.add_argument(
+        "--owner-id", type=str, required=True, help="Existing user owning the test sessions"
+    )
+    parser.add_argument("--lengths", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = create_client(
+        os.getenv("SUPABASE_PROJECT_URL"), os.getenv("SUPABASE_PRIVATE_API_KEY")
+    )
+
+    print(f"{'messages':>10} {'client-side':>12} {'database':>12}")
+    for length in args.lengths:
+        session_id = add_session(client, args.owner_id, {"type": "start"}, {})
+        created = [session_id]
+        try:
+            for i in range(0, length, 500):
+                add_multiple_messages(
+                    client,
+                    session_id,
+                    [
+                        {"type": "message", "message": f"bench message {j} " + "lorem " * 30}
+                        for j in range(i, min(i + 500, length))
+                    ],
+                    (i // 500) % 2 == 0,
+                )
+
+            timings = {"client": [], "database": []}
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                created.append(duplicate_session_client_side(client, session_id))
+                timings["client"].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                created.append(duplicate_session(client, session_id))
+                timings["database"].append(time.perf_counter() - start)
+
+            print(
+                f"{length:>10} {min(timings['client']) * 1000:>10.0f}ms {min(timings['database']) * 1000:>10.0f}ms"
+            )
+        finally:
+            delete_sessions(client, [id for id in created if id is not None])
@@ -0,0 +1,136 @@
+import argparse
+import gc
+import json
+import resource
+import subprocess
+import sys
+from dataclasses import dataclass
+from datetime import datetime, UTC
+
+from yourapp.scripts.bench_payload_decoding import mixed_payloads
+from yourapp.sessions import Session
+from yourapp.sessions.messages import message_from_row
+
+
+@dataclass
+class DataclassMessage:
+    """The former Message: a plain dataclass holding its decoded payload."""
+
+    id: int
+    payload: dict
+    created_at: datetime
+    is_system: bool
+
+
+@dataclass
+class DataclassSession:
+    """The former Session: a plain dataclass."""
+
+    id: int
+    owner_id: str
+    title: str
+    created_at: datetime
+    last_activity_at: datetime
+    system_state: dict
+    user_state: dict
+    is_open: bool
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # peak rather than current, but nothing is freed while measuring
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def history_rows(session_id: int, length: int) -> list[dict]:
+    """Rows of `sessions messages`, encoded anew like the database client would."""
+    return [
+        {
+            "id": session_id * length + i,
+            "payload_json": json.dumps(payload),
+            "created_at": datetime.now(UTC).isoformat(),
+            "is_system": i % 2 == 0,
+        }
+        for i, payload in enumerate(mixed_payloads(length, seed=session_id))
+    ]
+
+
+def open_session(variant: str, session_id: int, length: int):
+    now = datetime.now(UTC)
+    rows = history_rows(session_id, length)
+    if variant == "dataclass":
+        session = DataclassSession(
+            session_id, "owner", "title", now, now, {"type": "start"}, {}, True
+        )
+        history = [
+            DataclassMessage(
+                id=row["id"],
+                payload=json.loads(row["payload_json"]),
+                created_at=datetime.fromisoformat(row["created_at"]),
+                is_system=row["is_system"],
+            )
+            for row in rows
+        ]
+    else:
+        session = Session(session_id, "owner", "title", now, now, {"type": "start"}, {}, True)
+        history = [message_from_row(row) for row in rows]
+        if variant == "slotted-decoded":
+            for message in history:
+                message.payload
+    return session, history
+
+
+def measure(variant: str, sessions: int, length: int) -> int:
+    """Resident memory taken by `sessions` open sessions, in this process."""
+    gc.collect()
+    before = rss_bytes()
+    open_sessions = [open_session(variant, i, length) for i in range(sessions)]
+    gc.collect()
+    after = rss_bytes()
+    assert len(open_sessions) == sessions
+    return after - before
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Resident memory of open sessions and their histories, per Message representation"
+    )
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--length", type=int, default=500, help="Messages per history")
+    parser.add_argument(
+        "--variant",
+        type=str,
+        choices=["dataclass", "slotted", "slotted-decoded"],
+        help="Measure a single variant in this process and print its bytes",
+    )
+    args = parser.parse_args()
+
+    if args.variant is not None:
+        print(measure(args.variant, args.sessions, args.length))
+        sys.exit(0)
+
+    print(f"{args.sessions} open sessions with {args.length} messages each")
+    print(f"{'':<16} {'RSS':>10} {'per session':>12}")
+    for variant in ["dataclass", "slotted", "slotted-decoded"]:
+        # a process per variant, so that memory freed by one does not flatter the next
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "yourapp.scripts.bench_session_memory",
+                "--variant",
+                variant,
+                "--sessions",
+                str(args.sessions),
+                "--length",
+                str(args.length),
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        rss = int(result.stdout.strip())
+        print(f"{variant:<16} {rss / 2**20:>8.0f}MB {rss / args.sessions / 2**10:>10.0f}KB")
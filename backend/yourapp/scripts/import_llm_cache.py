@@ -0,0 +1,20 @@
+import argparse
+import time
+
+from yourapp.llms.cache import import_csv_cache
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Import an ask_llm CSV cache into an indexed SQLite cache"
+    )
+    parser.add_argument("csv_path", type=str, help="Existing CSV cache")
+    parser.add_argument(
+        "sqlite_path", type=str, help="SQLite cache to create or extend (.sqlite)"
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    count = import_csv_cache(args.csv_path, args.sqlite_path)
+    elapsed = time.perf_counter() - start
+    print(f"imported {count} rows into {args.sqlite_path} in {elapsed:.1f}s")
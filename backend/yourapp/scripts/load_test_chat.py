@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import statistics
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+import jwt
+from dotenv import load_dotenv
+from websockets.exceptions import ConnectionClosed
+from websockets.sync.client import connect
+from supabase import create_client, Client as SupabaseClient
+
+
+# start the server with LLM_STUB=1 so that the load is the app's, not the providers'
+
+
+@dataclass
+class ChatRun:
+    session_id: Optional[int] = None
+    first_token: Optional[float] = None
+    duration: Optional[float] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class LevelStats:
+    runs: list[ChatRun] = field(default_factory=list)
+    peak_connected: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    connected: int = 0
+
+    def add(self, run: ChatRun):
+        with self.lock:
+            self.runs.append(run)
+
+    def connect(self):
+        with self.lock:
+            self.connected += 1
+            self.peak_connected = max(self.peak_connected, self.connected)
+
+    def disconnect(self):
+        with self.lock:
+            self.connected -= 1
+
+
+def run_chat(url: str, token: str, message: str, timeout: float, stats: LevelStats) -> ChatRun:
+    """Go through the example conversation once, in a new session."""
+    run = ChatRun()
+    start = time.perf_counter()
+    sent_at = None
+    try:
+        ws = connect(f"{url}/chat/-1?token={token}", open_timeout=timeout, max_size=None)
+    except Exception as e:
+        run.error = f"connect: {e}"
+        return run
+
+    stats.connect()
+    try:
+        while True:
+            payload = json.loads(ws.recv(timeout=timeout))["payload"]
+            if payload["type"] == "session_created":
+                run.session_id = payload["id"]
+            elif payload["type"] == "state" and payload["state"] == "opened":
+                if sent_at is None:
+                    sent_at = time.perf_counter()
+                ws.send(json.dumps({"type": "message", "message": message}))
+            elif payload["type"] == "message-delta" and run.first_token is None:
+                run.first_token = time.perf_counter() - sent_at
+            elif payload["type"] == "end":
+                run.duration = time.perf_counter() - start
+                break
+    except TimeoutError:
+        run.error = "timeout"
+    except ConnectionClosed:
+        run.error = "connection closed"
+    except Exception as e:
+        run.error = str(e)
+    finally:
+        ws.close()
+        stats.disconnect()
+    return run
+
+
+def run_level(
+    url: str, token: str, sessions: int, duration: float, ramp_up: float, timeout: float
+) -> LevelStats:
+    """Keep `sessions` chats running at all times for `duration` seconds."""
+    stats = LevelStats()
+    deadline = time.monotonic() + ramp_up + duration
+
+    def virtual_user(i: int):
+        time.sleep(ramp_up * i / sessions)
+        while time.monotonic() < deadline:
+            run = run_chat(url, token, f"load test {i}", timeout, stats)
+            stats.add(run)
+            if run.error is not None:
+                time.sleep(1.0)
+
+    threads = [
+        threading.Thread(target=virtual_user, args=(i,), daemon=True)
+        for i in range(sessions)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats
+
+
+def percentile(values: list[float], p: float) -> float:
+    if len(values) == 0:
+        return float("nan")
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(p) - 1]
+
+
+def delete_sessions(client: SupabaseClient, session_ids: list[int]):
+    for i in range(0, len(session_ids), 500):
+        chunk = session_ids[i : i + 500]
+        client.table("sessions messages").delete().in_("session_id", chunk).execute()
+        client.table("sessions").delete().in_("id", chunk).execute()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure how many simultaneous chats a server sustains per core. Start the server with LLM_STUB=1."
+    )
+    parser.add_argument("--url", type=str, default="ws://localhost:5000")
+    parser.add_argument(
+        "--user-id", type=str, required=True, help="Existing onboarded user running the chats"
+    )
+    parser.add_argument(
+        "--sessions", type=int, nargs="+", default=[10, 50, 100, 200, 400],
+        help="Levels of simultaneous chats to try, in order",
+    )
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per level")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="Seconds to open all chats of a level")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds without a frame before a chat fails")
+    parser.add_argument(
+        "--max-first-token", type=float, default=2.0,
+        help="p95 seconds from user message to first streamed token for a level to count as sustained",
+    )
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument(
+        "--server-cores", type=int, default=os.cpu_count(), help="Cores given to the server"
+    )
+    parser.add_argument("--keep-sessions", action="store_true", help="Do not delete the sessions created")
+    args = parser.parse_args()
+
+    load_dotenv()
+    token = jwt.encode(
+        {"id": args.user_id, "credentials": {}}, os.getenv("APP_SECRET"), algorithm="HS256"
+    )
+
+    created = []
+    sustained = 0
+    print(
+        f"{'sessions':>9} {'peak':>6} {'chats':>7} {'errors':>7} {'chats/s':>8} "
+        f"{'p50 1st':>8} {'p95 1st':>8} {'p95 chat':>9}"
+    )
+    try:
+        for sessions in args.sessions:
+            stats = run_level(
+                args.url, token, sessions, args.duration, args.ramp_up, args.timeout
+            )
+            created += [run.session_id for run in stats.runs if run.session_id is not None]
+
+            done = [run for run in stats.runs if run.error is None]
+            errors = len(stats.runs) - len(done)
+            first_tokens = [run.first_token for run in done if run.first_token is not None]
+            durations = [run.duration for run in done]
+            error_rate = errors / max(len(stats.runs), 1)
+            p95_first_token = percentile(first_tokens, 95)
+            print(
+                f"{sessions:>9} {stats.peak_connected:>6} {len(done):>7} {errors:>7} "
+                f"{len(done) / (args.duration + args.ramp_up):>8.1f} "
+                f"{percentile(first_tokens, 50):>7.2f}s {p95_first_token:>7.2f}s "
+                f"{percentile(durations, 95):>8.2f}s"
+            )
+            for error in sorted({run.error for run in stats.runs if run.error is not None}):
+                print(f"{'':>9} error: {error}")
+
+            if error_rate > args.max_error_rate or not p95_first_token <= args.max_first_token:
+                break
+            sustained = sessions
+    finally:
+        if not args.keep_sessions and len(created) > 0:
+            delete_sessions(
+                create_client(
+                    os.getenv("SUPABASE_PROJECT_URL"), os.getenv("SUPABASE_PRIVATE_API_KEY")
+                ),
+                created,
+            )
+
+    print(
+        f"sustained {sustained} simultaneous chats on {args.server_cores} cores: "
+        f"{sustained / args.server_cores:.1f} per core"
+    )
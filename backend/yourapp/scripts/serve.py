@@ -0,0 +1,173 @@
+import sys
+
+
+def patch_for_gevent(argv: list[str]) -> bool:
+    """
+    Monkey patch the standard library if gevent workers are requested, before
+    this module imports anything else: modules imported earlier, threading
+    first, would keep unpatched locks. Returns False if gevent is missing.
+    """
+    if "--worker-class=gevent" not in argv and not any(
+        arg == "--worker-class" and value == "gevent" for arg, value in zip(argv, argv[1:])
+    ):
+        return True
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    monkey.patch_all()
+    return True
+
+
+if __name__ == "__main__":
+    GEVENT_AVAILABLE = patch_for_gevent(sys.argv[1:])
+
+import argparse
+import multiprocessing
+import os
+import signal
+import threading
+
+
+def close_live_sessions_on_exit(worker, timeout: float):
+    """Make the worker disconnect its chats as soon as it is asked to stop."""
+    from yourapp.chat.live import close_live_sessions
+    from yourapp.scripts.server import supabase
+
+    handle_exit = worker.handle_exit
+    exiting = threading.Event()
+
+    def close_when_exiting():
+        exiting.wait()
+        close_live_sessions(supabase, timeout)
+
+    # signal handlers must not block, which starting a thread does under gevent
+    threading.Thread(
+        target=close_when_exiting, name="close-live-sessions", daemon=True
+    ).start()
+
+    def handle_exit_and_close_live_sessions(sig, frame):
+        handle_exit(sig, frame)
+        exiting.set()
+
+    signal.signal(signal.SIGTERM, handle_exit_and_close_live_sessions)
+
+
+def build_application(app, options: dict):
+    from gunicorn.app.base import BaseApplication
+
+    class YourappApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    return YourappApplication()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Production server: the app served by gunicorn with a pool of thread or gevent workers"
+    )
+    parser.add_argument("--host", type=str, default="0.0.0.0", help="Host address")
+    parser.add_argument("--port", type=int, default=5000, help="Port number")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count())),
+        help="Number of worker processes (default: WEB_CONCURRENCY or the number of cores)",
+    )
+    parser.add_argument(
+        "--worker-class",
+        type=str,
+        choices=["gthread", "gevent"],
+        default="gthread",
+        help="gthread pins one thread per chat, gevent one greenlet (requires gevent)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=64,
+        help="Threads per gthread worker, i.e. its maximum number of simultaneous chats",
+    )
+    parser.add_argument(
+        "--worker-connections",
+        type=int,
+        default=1000,
+        help="Maximum simultaneous connections per gevent worker",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=int,
+        default=30,
+        help="Seconds given to live chats to persist and close their session on shutdown",
+    )
+    parser.add_argument("--trace", action="store_true", help="Enable trace logging")
+    parser.add_argument(
+        "--close-all-sessions",
+        action="store_true",
+        help="Close every open session before serving, not only this server's (sessions opened before sql/006)",
+    )
+
+    args = parser.parse_args()
+
+    # patched already, see patch_for_gevent
+    if args.worker_class == "gevent" and not GEVENT_AVAILABLE:
+        parser.error("--worker-class gevent requires gevent: pip install gevent")
+
+    from supabase import create_client
+    from yourapp.chat.live import (
+        close_live_sessions,
+        start_session_heartbeats,
+        websocket_wsgi_middleware,
+    )
+    from yourapp.sessions import close_all_open_sessions
+    from yourapp.scripts.server import (
+        SUPABASE_PRIVATE_API_KEY,
+        SUPABASE_PROJECT_URL,
+        app,
+        close_worker_sessions_in_background,
+        setup_server_logging,
+        supabase,
+    )
+
+    setup_server_logging(args.trace, __file__)
+    app.wsgi_app = websocket_wsgi_middleware(app.wsgi_app)
+
+    def on_starting(server):
+        if args.close_all_sessions:
+            # a client of its own: connections of the master must not leak into the workers
+            close_all_open_sessions(
+                create_client(SUPABASE_PROJECT_URL, SUPABASE_PRIVATE_API_KEY)
+            )
+
+    def post_worker_init(worker):
+        close_live_sessions_on_exit(worker, args.graceful_timeout * 0.8)
+        start_session_heartbeats(supabase)
+        # the workers share the lease of the master, the first one spawned does it
+        if not args.close_all_sessions and worker.age == 1:
+            close_worker_sessions_in_background(supabase)
+
+    def worker_int(worker):
+        close_live_sessions(supabase, timeout=1.0)
+
+    def worker_exit(server, worker):
+        close_live_sessions(supabase, timeout=0.0)
+
+    build_application(
+        app,
+        {
+            "bind": f"{args.host}:{args.port}",
+            "workers": args.workers,
+            "worker_class": args.worker_class,
+            "threads": args.threads,
+            "worker_connections": args.worker_connections,
+            "graceful_timeout": args.graceful_timeout,
+            "on_starting": on_starting,
+            "post_worker_init": post_worker_init,
+            "worker_int": worker_int,
+            "worker_exit": worker_exit,
+        },
+    ).run()
@@ -1,16 +1,20 @@
 import logging
 import os
 import argparse
+import threading
 from flask import Flask
 from flask_cors import CORS, cross_origin
+from loguru import logger
 from supabase import create_client, Client as SupabaseClient
 from dotenv import load_dotenv
 
 from yourapp.auth.controller import init_auth_routes
 from yourapp.chat.controller import init_chat_routes
-from yourapp.sessions import close_all_open_sessions
+from yourapp.chat.live import close_live_sessions, start_session_heartbeats
+from yourapp.sessions import close_all_open_sessions, close_all_worker_sessions
 from yourapp.sessions.controller import add_sessions_routes
 from yourapp.user.controller import init_user_routes
+from yourapp.utils.codec import CodecJSONProvider
 from yourapp.utils.logging import setup_simple_logger
 
 
@@ -24,6 +28,7 @@ supabase: SupabaseClient = create_client(SUPABASE_PROJECT_URL, SUPABASE_PRIVATE_
 APP_SECRET = os.getenv("APP_SECRET")
 
 app = Flask(__name__)
+app.json = CodecJSONProvider(app)
 CORS(app)
 
 
@@ -45,25 +50,58 @@ def index():
     return "Yourapp API"
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--host", type=str, default="localhost", help="Host address")
-    parser.add_argument("--port", type=int, default=5000, help="Port number")
-    parser.add_argument("--trace", action="store_true", help="Enable trace logging")
-
-    args = parser.parse_args()
-
+def setup_server_logging(trace: bool, script_file: str = __file__):
     log_level = (
         "trace"
-        if args.trace
+        if trace
         else ("debug" if os.getenv("ENVIRONMENT") == "dev" else "info")
     )
-    setup_simple_logger(log_level, log_file=".logs/" + os.path.basename(__file__) + ".{time:YYYY-MM-DD_HH-mm-ss!UTC}.log")
+    setup_simple_logger(log_level, log_file=".logs/" + os.path.basename(script_file) + ".{time:YYYY-MM-DD_HH-mm-ss!UTC}.log")
 
     logging.getLogger("werkzeug").setLevel(logging.WARNING)
     logging.getLogger("urllib3").setLevel(logging.WARNING)
     logging.getLogger("httpx").setLevel(logging.WARNING)
 
-    close_all_open_sessions(supabase)
 
-    app.run(host=args.host, port=args.port)
+def close_worker_sessions_in_background(client: SupabaseClient) -> threading.Thread:
+    """Close the sessions left open by former runs of this server while it serves."""
+
+    def close():
+        count = close_all_worker_sessions(client)
+        if count is None:
+            logger.error("failed to close the sessions left open by the former run")
+        else:
+            logger.info(f"{count} sessions left open by the former run closed")
+
+    thread = threading.Thread(target=close, name="close-worker-sessions", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Development server, see yourapp/scripts/serve.py for production"
+    )
+    parser.add_argument("--host", type=str, default="localhost", help="Host address")
+    parser.add_argument("--port", type=int, default=5000, help="Port number")
+    parser.add_argument("--trace", action="store_true", help="Enable trace logging")
+    parser.add_argument(
+        "--close-all-sessions",
+        action="store_true",
+        help="Close every open session before serving, not only this server's (sessions opened before sql/006)",
+    )
+
+    args = parser.parse_args()
+
+    setup_server_logging(args.trace)
+
+    if args.close_all_sessions:
+        close_all_open_sessions(supabase)
+    else:
+        close_worker_sessions_in_background(supabase)
+    start_session_heartbeats(supabase)
+
+    try:
+        app.run(host=args.host, port=args.port)
+    finally:
+        close_live_sessions(supabase, timeout=5.0)
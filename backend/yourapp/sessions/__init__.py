@@ -1,17 +1,20 @@
-from dataclasses import dataclass
-import json
+from dataclasses import dataclass, replace
+import copy
+import os
+import socket
+import threading
+import uuid
 from typing import Optional
 from loguru import logger
 from supabase import Client as SupabaseClient
 from datetime import datetime, UTC
 
-from yourapp.sessions.messages import (
-    duplicate_all_session_messages_and_assign_to_new_session,
-)
+from yourapp.utils import codec
 from yourapp.utils.generate_name import generate_randome_tripartite_name
+from yourapp.utils.ttl_cache import TTLCache
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Session:
     id: int
     owner_id: str
@@ -27,14 +30,169 @@ class Session:
             "id": self.id,
             "owner_id": self.owner_id,
             "title": self.title,
-            "created_at": self.created_at.isoformat(),
-            "last_activity_at": self.last_activity_at.isoformat(),
+            "created_at": self.created_at,
+            "last_activity_at": self.last_activity_at,
             "system_state": self.system_state,
             "user_state": self.user_state,
             "is_open": self.is_open,
         }
 
 
+def session_from_row(row: dict) -> Session:
+    return Session(
+        id=row["id"],
+        title=row["title"],
+        created_at=datetime.fromisoformat(row["created_at"]),
+        last_activity_at=datetime.fromisoformat(row["last_activity_at"]),
+        system_state=codec.loads(row["system_state_json"]),
+        user_state=codec.loads(row["user_state_json"]),
+        owner_id=row["owner_id"],
+        is_open=row["is_open"],
+    )
+
+
+_HOT_SESSIONS_CACHE: Optional[TTLCache[int, Session]] = None
+_HOT_SESSIONS_LOCK = threading.RLock()
+
+
+def get_hot_sessions_cache() -> TTLCache[int, Session]:
+    """
+    Sessions added or opened by this process, until they are closed or deleted,
+    configured on first use by environment variables: HOT_SESSIONS_CACHE_TTL
+    (seconds, default 3600) and HOT_SESSIONS_CACHE_SIZE (default 10000).
+
+    An open session is only written to by the process serving its chat, through
+    this module, which writes every change through to the cache. The cache
+    keeps snapshots of its own, see `snapshot_session`.
+    """
+    global _HOT_SESSIONS_CACHE
+    with _HOT_SESSIONS_LOCK:
+        if _HOT_SESSIONS_CACHE is None:
+            _HOT_SESSIONS_CACHE = TTLCache(
+                max_size=int(os.getenv("HOT_SESSIONS_CACHE_SIZE", "10000")),
+                ttl=float(os.getenv("HOT_SESSIONS_CACHE_TTL", "3600")),
+            )
+        return _HOT_SESSIONS_CACHE
+
+
+def snapshot_session(session: Session) -> Session:
+    """
+    A copy of `session` sharing none of its states: the chat changes the states
+    it was given in place, which must not change the cached session.
+    """
+    return replace(
+        session,
+        system_state=copy.deepcopy(session.system_state),
+        user_state=copy.deepcopy(session.user_state),
+    )
+
+
+def get_hot_session(session_id: int) -> Optional[Session]:
+    session = get_hot_sessions_cache().get(session_id)
+    return snapshot_session(session) if session is not None else None
+
+
+def update_hot_session(
+    session_id: int, session: Optional[Session] = None, **session_changes
+):
+    """
+    Write changes through to a hot session, if this process has it: replace it
+    with `session` or change some of its fields.
+    """
+    cache = get_hot_sessions_cache()
+    with _HOT_SESSIONS_LOCK:
+        if cache.get(session_id) is None:
+            return
+        if session is None:
+            session = cache.get(session_id)
+        session = replace(session, **session_changes)
+        cache.set(session_id, snapshot_session(session))
+
+
+def cache_opened_session(session: Session):
+    get_hot_sessions_cache().set(session.id, snapshot_session(session))
+
+
+SESSIONS_PAGE_SIZE = 50
+SESSION_SUMMARY_COLUMNS = "id, title, last_activity_at, is_open"
+
+
+@dataclass(slots=True, frozen=True)
+class SessionSummary:
+    """What lists of sessions show of each, without their states."""
+
+    id: int
+    title: str
+    last_activity_at: datetime
+    is_open: bool
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "title": self.title,
+            "last_activity_at": self.last_activity_at,
+            "is_open": self.is_open,
+        }
+
+
+def get_session_summaries(
+    client: SupabaseClient,
+    user_id: str,
+    limit: int = SESSIONS_PAGE_SIZE,
+    before: Optional[tuple[datetime, int]] = None,
+) -> Optional[tuple[list[SessionSummary], Optional[tuple[datetime, int]]]]:
+    """
+    The `limit` most recently active sessions of a user that were active before
+    `before`, a (last_activity_at, id) pair, and the pair to pass as `before` to
+    get the next page, None if there is none (see sql/004_sessions_list_index.sql).
+    """
+    try:
+        logger.trace(
+            f"DB getting {limit} session summaries for user {user_id} (before {before})"
+        )
+        query = (
+            client.table("sessions")
+            .select(SESSION_SUMMARY_COLUMNS)
+            .eq("owner_id", user_id)
+        )
+        if before is not None:
+            last_activity_at, id = before
+            # quoted, timestamps containing reserved characters
+            query = query.or_(
+                f'last_activity_at.lt."{last_activity_at.isoformat()}",'
+                f'and(last_activity_at.eq."{last_activity_at.isoformat()}",id.lt.{id})'
+            )
+        # one extra row tells whether a next page exists
+        result = (
+            query.order("last_activity_at", desc=True)
+            .order("id", desc=True)
+            .limit(limit + 1)
+            .execute()
+        )
+
+        summaries = [
+            SessionSummary(
+                id=row["id"],
+                title=row["title"],
+                last_activity_at=datetime.fromisoformat(row["last_activity_at"]),
+                is_open=row["is_open"],
+            )
+            for row in result.data[:limit]
+        ]
+        cursor = (
+            (summaries[-1].last_activity_at, summaries[-1].id)
+            if len(result.data) > limit
+            else None
+        )
+
+        logger.trace(f"DB {len(summaries)} session summaries found for user {user_id}")
+        return summaries, cursor
+    except Exception as e:
+        logger.error(f"DB error getting session summaries for user {user_id}")
+        logger.exception(e)
+        return None
+
+
 def get_sessions(client: SupabaseClient, user_id: str) -> Optional[list[Session]]:
     try:
         logger.trace(f"DB getting sessions for user {user_id}")
@@ -49,22 +207,7 @@ def get_sessions(client: SupabaseClient, user_id: str) -> Optional[list[Session]
             logger.trace(f"DB no sessions found for user {user_id}")
             return []
 
-        sessions = []
-        for session in result.data:
-            sessions.append(
-                Session(
-                    id=session["id"],
-                    title=session["title"],
-                    created_at=datetime.fromisoformat(session["created_at"]),
-                    last_activity_at=datetime.fromisoformat(
-                        session["last_activity_at"]
-                    ),
-                    system_state=json.loads(session["system_state_json"]),
-                    user_state=json.loads(session["user_state_json"]),
-                    owner_id=session["owner_id"],
-                    is_open=session["is_open"],
-                )
-            )
+        sessions = [session_from_row(session) for session in result.data]
 
         logger.trace(f"DB {len(sessions)} sessions found for user {user_id}")
         return sessions
@@ -75,6 +218,11 @@ def get_sessions(client: SupabaseClient, user_id: str) -> Optional[list[Session]
 
 
 def get_session(client: SupabaseClient, session_id: int) -> Optional[Session]:
+    """The session, from the hot sessions cache if this process has it open."""
+    hot_session = get_hot_session(session_id)
+    if hot_session is not None:
+        return hot_session
+
     try:
         logger.trace(f"DB getting session {session_id}")
         result = (
@@ -84,20 +232,9 @@ def get_session(client: SupabaseClient, session_id: int) -> Optional[Session]:
             logger.error(f"DB no session found for id {session_id}")
             return None
 
-        session = result.data[0]
-
         logger.trace(f"DB session {session_id} found")
 
-        return Session(
-            id=session["id"],
-            title=session["title"],
-            created_at=datetime.fromisoformat(session["created_at"]),
-            last_activity_at=datetime.fromisoformat(session["last_activity_at"]),
-            system_state=json.loads(session["system_state_json"]),
-            user_state=json.loads(session["user_state_json"]),
-            owner_id=session["owner_id"],
-            is_open=session["is_open"],
-        )
+        return session_from_row(result.data[0])
     except Exception as e:
         logger.error(f"DB error getting session {session_id}")
         logger.exception(e)
@@ -118,6 +255,7 @@ def open_session(client: SupabaseClient, session_id: int) -> Optional[int]:
             return None
 
         logger.trace(f"DB session {session_id} opened")
+        cache_opened_session(session_from_row(result.data[0]))
         return result.data[0]["id"]
     except Exception as e:
         logger.error(f"DB error opening session {session_id}")
@@ -125,6 +263,67 @@ def open_session(client: SupabaseClient, session_id: int) -> Optional[int]:
         return None
 
 
+# new on each start, inherited by the workers forked from the server
+_WORKER_LEASE = str(uuid.uuid4())
+
+
+def get_worker_lease() -> tuple[str, str]:
+    """
+    The (worker id, lease) pair of the sessions this server opens. The worker id,
+    WORKER_ID or the host name by default, names the server across restarts and
+    must differ between the servers sharing a database. The lease names this run.
+    """
+    return os.getenv("WORKER_ID") or socket.gethostname(), _WORKER_LEASE
+
+
+def get_session_stale_after() -> float:
+    """
+    Seconds without heartbeat after which an open session is considered left
+    open by a server that died, SESSION_STALE_AFTER (default 120).
+    """
+    return float(os.getenv("SESSION_STALE_AFTER", "120"))
+
+
+def claim_session(
+    client: SupabaseClient, session_id: int, owner_id: str
+) -> Optional[Session]:
+    """
+    Open a session of `owner_id` if it is closed or stale, or a copy of it if it
+    is open already, in a single transaction, leasing it to this server (see
+    sql/005_claim_session.sql to sql/007_session_heartbeats.sql). Returns the
+    opened session, whose id differs from `session_id` if it is a copy, or None
+    if `owner_id` has no such session.
+    """
+    try:
+        logger.trace(f"DB claiming session {session_id}")
+        worker_id, worker_lease = get_worker_lease()
+        result = client.rpc(
+            "claim_session",
+            {
+                "p_session_id": session_id,
+                "p_owner_id": owner_id,
+                "p_worker_id": worker_id,
+                "p_worker_lease": worker_lease,
+                "p_stale_after": get_session_stale_after(),
+            },
+        ).execute()
+        if len(result.data) == 0:
+            logger.trace(f"DB no session {session_id} claimable by user {owner_id}")
+            return None
+
+        session = session_from_row(result.data[0])
+        if result.data[0]["duplicated_from"] is not None:
+            logger.trace(f"DB session {session_id} open, duplicated to {session.id}")
+        else:
+            logger.trace(f"DB session {session_id} opened")
+        cache_opened_session(session)
+        return session
+    except Exception as e:
+        logger.error(f"DB error claiming session {session_id}")
+        logger.exception(e)
+        return None
+
+
 def close_session(client: SupabaseClient, session_id: int) -> Optional[int]:
     try:
         logger.trace(f"DB closing session {session_id}")
@@ -139,6 +338,7 @@ def close_session(client: SupabaseClient, session_id: int) -> Optional[int]:
             return None
 
         logger.trace(f"DB session {session_id} closed")
+        get_hot_sessions_cache().invalidate(session_id)
         return result.data[0]["id"]
     except Exception as e:
         logger.error(f"DB error closing session {session_id}")
@@ -160,6 +360,8 @@ def close_all_open_sessions(client: SupabaseClient) -> Optional[list[int]]:
             return []
 
         logger.trace(f"DB {len(result.data)} open sessions closed")
+        for session in result.data:
+            get_hot_sessions_cache().invalidate(session["id"])
         return [s["id"] for s in result.data]
     except Exception as e:
         logger.error("DB error closing all open sessions")
@@ -167,6 +369,98 @@ def close_all_open_sessions(client: SupabaseClient) -> Optional[list[int]]:
         return None
 
 
+CLOSE_WORKER_SESSIONS_CHUNK_SIZE = 500
+
+
+def close_worker_sessions(
+    client: SupabaseClient, limit: int = CLOSE_WORKER_SESSIONS_CHUNK_SIZE
+) -> Optional[list[int]]:
+    """
+    Close up to `limit` of the sessions left open by former runs of this server,
+    returning their ids (see sql/006_session_worker_leases.sql).
+    """
+    try:
+        worker_id, worker_lease = get_worker_lease()
+        logger.trace(f"DB closing up to {limit} sessions left open by worker {worker_id}")
+        result = client.rpc(
+            "close_worker_sessions",
+            {"p_worker_id": worker_id, "p_worker_lease": worker_lease, "p_limit": limit},
+        ).execute()
+
+        logger.trace(f"DB {len(result.data)} sessions of worker {worker_id} closed")
+        return result.data
+    except Exception as e:
+        logger.error("DB error closing sessions left open by this worker")
+        logger.exception(e)
+        return None
+
+
+def close_all_worker_sessions(
+    client: SupabaseClient, chunk_size: int = CLOSE_WORKER_SESSIONS_CHUNK_SIZE
+) -> Optional[int]:
+    """
+    Close every session left open by former runs of this server, a chunk at a
+    time so that sessions opened meanwhile are not held up. Returns the number of
+    sessions closed, None if a chunk failed.
+    """
+    count = 0
+    while True:
+        closed = close_worker_sessions(client, chunk_size)
+        if closed is None:
+            return None
+        count += len(closed)
+        if len(closed) < chunk_size:
+            return count
+
+
+def heartbeat_sessions(client: SupabaseClient, session_ids: list[int]) -> Optional[int]:
+    """
+    Record that this server still serves the given sessions, in a single query,
+    returning the number of them still leased to it (see sql/007_session_heartbeats.sql).
+    """
+    try:
+        logger.trace(f"DB heartbeat of {len(session_ids)} sessions")
+        _, worker_lease = get_worker_lease()
+        result = client.rpc(
+            "heartbeat_sessions",
+            {"p_session_ids": session_ids, "p_worker_lease": worker_lease},
+        ).execute()
+
+        logger.trace(f"DB heartbeat of {result.data} sessions recorded")
+        return result.data
+    except Exception as e:
+        logger.error(f"DB error recording heartbeat of {len(session_ids)} sessions")
+        logger.exception(e)
+        return None
+
+
+CLOSE_STALE_SESSIONS_CHUNK_SIZE = 500
+
+
+def close_stale_sessions(
+    client: SupabaseClient, limit: int = CLOSE_STALE_SESSIONS_CHUNK_SIZE
+) -> Optional[list[int]]:
+    """
+    Close up to `limit` sessions whose server stopped sending heartbeats,
+    whichever server it was, returning their ids (see sql/007_session_heartbeats.sql).
+    """
+    try:
+        stale_after = get_session_stale_after()
+        logger.trace(f"DB closing up to {limit} sessions stale for {stale_after}s")
+        result = client.rpc(
+            "close_stale_sessions", {"p_stale_after": stale_after, "p_limit": limit}
+        ).execute()
+
+        logger.trace(f"DB {len(result.data)} stale sessions closed")
+        for session_id in result.data:
+            get_hot_sessions_cache().invalidate(session_id)
+        return result.data
+    except Exception as e:
+        logger.error("DB error closing stale sessions")
+        logger.exception(e)
+        return None
+
+
 def delete_session(client: SupabaseClient, session_id: int) -> Optional[int]:
     try:
         logger.trace(f"DB deleting session {session_id}")
@@ -176,6 +470,7 @@ def delete_session(client: SupabaseClient, session_id: int) -> Optional[int]:
             return None
 
         logger.trace(f"DB session {session_id} deleted")
+        get_hot_sessions_cache().invalidate(session_id)
         return result.data[0]["id"]
     except Exception as e:
         logger.error(f"DB error deleting session {session_id}")
@@ -194,8 +489,8 @@ def add_session(
                 {
                     "owner_id": owner_id,
                     "title": generate_randome_tripartite_name(),
-                    "system_state_json": json.dumps(system_state),
-                    "user_state_json": json.dumps(user_state),
+                    "system_state_json": codec.dumps(system_state),
+                    "user_state_json": codec.dumps(user_state),
                 }
             )
             .execute()
@@ -205,6 +500,7 @@ def add_session(
             return None
 
         logger.trace(f"DB session {result.data[0]['id']} added for user {owner_id}")
+        cache_opened_session(session_from_row(result.data[0]))
         return result.data[0]["id"]
     except Exception as e:
         logger.error(f"DB error adding session for user {owner_id}")
@@ -213,46 +509,19 @@ def add_session(
 
 
 def duplicate_session(client: SupabaseClient, session_id: int) -> Optional[int]:
+    """Copy a session and its messages in the database (see sql/001_duplicate_session.sql)."""
     try:
         logger.trace(f"DB duplicating session {session_id}")
-        session = get_session(client, session_id)
-        if session is None:
-            logger.error(f"DB no session found for id {session_id}")
-            return None
-
-        session_title_ends_with_number = session.title[-3:].isdigit()
-        new_session_title = session.title + " 1"
-        if session_title_ends_with_number:
-            new_session_title = f"{session.title[:-2]}{int(session.title[-2:]) + 1}"
-
-        result = (
-            client.table("sessions")
-            .insert(
-                {
-                    "owner_id": session.owner_id,
-                    "title": new_session_title,
-                    "system_state_json": json.dumps(session.system_state),
-                    "user_state_json": json.dumps(session.user_state),
-                }
-            )
-            .execute()
-        )
+        result = client.rpc("duplicate_session", {"p_session_id": session_id}).execute()
         if len(result.data) == 0:
             logger.error(f"DB no session duplicated for id {session_id}")
             return None
 
-        new_session_id = result.data[0]["id"]
-        result = duplicate_all_session_messages_and_assign_to_new_session(
-            client, session_id, new_session_id
-        )
-
-        if result is None:
-            logger.error(
-                f"DB messages duplication failed, stoping duplication for id {session_id}"
-            )
-            return None
+        new_session_id = result.data[0]["new_session_id"]
 
-        logger.trace(f"DB session {session_id} duplicated")
+        logger.trace(
+            f"DB session {session_id} duplicated to {new_session_id} with {result.data[0]['message_count']} messages"
+        )
 
         return new_session_id
     except Exception as e:
@@ -271,8 +540,8 @@ def update_states(
             client.table("sessions")
             .update(
                 {
-                    "system_state_json": json.dumps(system_state),
-                    "user_state_json": json.dumps(user_state),
+                    "system_state_json": codec.dumps(system_state),
+                    "user_state_json": codec.dumps(user_state),
                     "last_activity_at": datetime.now(UTC).isoformat(),
                 }
             )
@@ -284,6 +553,7 @@ def update_states(
             return None
 
         logger.trace(f"DB session {session_id} updated")
+        update_hot_session(session_id, session=session_from_row(result.data[0]))
         return result.data[0]["id"]
     except Exception as e:
         logger.error(f"DB error updating states for session {session_id}")
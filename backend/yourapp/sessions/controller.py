@@ -1,8 +1,34 @@
-from flask import jsonify
+from datetime import datetime
+from flask import Response, jsonify, request
 from flask_cors import cross_origin
 from supabase import Client as SupabaseClient
 
-from yourapp.sessions import get_sessions, get_session
+from yourapp.sessions import (
+    SESSIONS_PAGE_SIZE,
+    get_session,
+    get_session_summaries,
+    get_sessions,
+)
+from yourapp.sessions.messages import (
+    HISTORY_PAGE_SIZE,
+    get_last_messages,
+    messages_to_json,
+)
+from yourapp.utils import codec
+
+
+def conditional_json(data) -> Response:
+    """A JSON response with an ETag, turned into a 304 if the request already has it."""
+    response = jsonify(data)
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def parse_timestamp(value: str) -> datetime:
+    # a + of the timezone left unencoded in the query string arrives as a space
+    return datetime.fromisoformat(value.replace(" ", "+"))
 
 
 def add_sessions_routes(app, login_required, admin_client: SupabaseClient):
@@ -10,10 +36,46 @@ def add_sessions_routes(app, login_required, admin_client: SupabaseClient):
     @cross_origin()
     @login_required
     def fetch_sessions(user_id):
-        sessions = get_sessions(admin_client, user_id)
-        if sessions is None:
+        """
+        All the sessions of the user, or with `?summary=true` pages of their
+        summaries, most recently active first: pass the `cursor` of a page as
+        `before` and `before_id` to get the next one.
+
+        Responses carry an ETag: requests with a matching If-None-Match get a 304.
+        """
+        if request.args.get("summary") not in ("true", "1"):
+            sessions = get_sessions(admin_client, user_id)
+            if sessions is None:
+                return jsonify({"error": "Internal server error"}), 500
+            return conditional_json(
+                {"sessions": [session.to_dict() for session in sessions]}
+            )
+
+        limit = request.args.get("limit", default=SESSIONS_PAGE_SIZE, type=int)
+        before = request.args.get("before", type=parse_timestamp)
+        before_id = request.args.get("before_id", type=int)
+        if (before is None) != (before_id is None):
+            return jsonify({"error": "before and before_id go together"}), 400
+
+        result = get_session_summaries(
+            admin_client,
+            user_id,
+            max(1, min(limit, SESSIONS_PAGE_SIZE)),
+            (before, before_id) if before is not None else None,
+        )
+        if result is None:
             return jsonify({"error": "Internal server error"}), 500
-        return jsonify({"sessions": [session.to_dict() for session in sessions]})
+        summaries, cursor = result
+        return conditional_json(
+            {
+                "sessions": summaries,
+                "cursor": (
+                    {"before": cursor[0], "before_id": cursor[1]}
+                    if cursor is not None
+                    else None
+                ),
+            }
+        )
 
     @app.route("/sessions/<session_id>", methods=["GET"])
     @cross_origin()
@@ -23,3 +85,27 @@ def add_sessions_routes(app, login_required, admin_client: SupabaseClient):
         if session is None:
             return jsonify({"error": "Session not found"}), 404
         return jsonify(session.to_dict())
+
+    @app.route("/sessions/<session_id>/messages", methods=["GET"])
+    @cross_origin()
+    @login_required
+    def fetch_session_messages(user_id, session_id):
+        session = get_session(admin_client, int(session_id))
+        if session is None:
+            return jsonify({"error": "Session not found"}), 404
+        if session.owner_id != user_id:
+            return jsonify({"error": "Unauthorized"}), 401
+
+        before_id = request.args.get("before_id", type=int)
+        limit = request.args.get("limit", default=HISTORY_PAGE_SIZE, type=int)
+
+        result = get_last_messages(
+            admin_client, session.id, max(1, min(limit, HISTORY_PAGE_SIZE)), before_id
+        )
+        if result is None:
+            return jsonify({"error": "Internal server error"}), 500
+        messages, cursor = result
+        return Response(
+            f'{{"messages":{messages_to_json(messages)},"cursor":{codec.dumps(cursor)}}}',
+            mimetype="application/json",
+        )
@@ -1,26 +1,109 @@
-from dataclasses import dataclass
-import json
 from typing import Optional
 from loguru import logger
 from supabase import Client as SupabaseClient
 from datetime import datetime
 
+from yourapp.utils import codec
+
+
+HISTORY_PAGE_SIZE = 200
+MESSAGE_COLUMNS = "id, payload_json, created_at, is_system"
+
+_JSON_LITERALS = {None: "null", True: "true", False: "false"}
+
 
-@dataclass
 class Message:
-    id: int
-    payload: dict
+    """
+    A message of a session. Messages loaded from the database keep their payload
+    as JSON text, decoded on first access of `payload` only: chats hold their
+    whole history but mostly send it back as it is.
+    """
+
+    __slots__ = ("id", "created_at", "is_system", "_payload", "_payload_json")
+
+    id: Optional[int]
     created_at: datetime
     is_system: bool
 
+    def __init__(
+        self,
+        id: Optional[int],
+        payload: Optional[dict],
+        created_at: datetime,
+        is_system: bool,
+        payload_json: Optional[str] = None,
+    ):
+        self.id = id
+        self.created_at = created_at
+        self.is_system = is_system
+        self._payload = payload
+        self._payload_json = payload_json
+
+    @property
+    def payload(self) -> Optional[dict]:
+        if self._payload is None and self._payload_json is not None:
+            self._payload = codec.loads(self._payload_json)
+            self._payload_json = None
+        return self._payload
+
     def to_dict(self) -> dict:
         return {
             "id": self.id,
-            "payload": self.payload,
-            "created_at": self.created_at.isoformat(),
+            # decoded without keeping it, as sent messages are rarely read again
+            "payload": (
+                self._payload
+                if self._payload_json is None
+                else codec.loads(self._payload_json)
+            ),
+            "created_at": self.created_at,
             "is_system": self.is_system,
         }
 
+    @property
+    def payload_json(self) -> str:
+        """The payload as JSON text, encoded only if it was built from a dict or already decoded."""
+        if self._payload_json is not None:
+            return self._payload_json
+        return codec.dumps(self._payload)
+
+    def to_json(self) -> str:
+        """Encode the message, splicing in its raw payload instead of decoding and encoding it again."""
+        return (
+            f'{{"id":{self.id if self.id is not None else "null"},'
+            f'"payload":{self.payload_json},'
+            f'"created_at":{codec.dumps(self.created_at)},'
+            f'"is_system":{_JSON_LITERALS[self.is_system]}}}'
+        )
+
+    def __eq__(self, value: object) -> bool:
+        if not isinstance(value, Message):
+            return NotImplemented
+        return self.to_dict() == value.to_dict()
+
+    def __repr__(self) -> str:
+        return (
+            f"Message(id={self.id!r}, payload={self.to_dict()['payload']!r}, "
+            f"created_at={self.created_at!r}, is_system={self.is_system!r})"
+        )
+
+
+def messages_to_json(messages: list[Message]) -> str:
+    """Encode messages as a JSON array, see `Message.to_json`."""
+    return "[" + ",".join([message.to_json() for message in messages]) + "]"
+
+
+def message_from_row(row: dict) -> Message:
+    """Build a Message from a `sessions messages` row, columns left out by a projection being None."""
+    payload_json = row.get("payload_json")
+    created_at = row.get("created_at")
+    return Message(
+        id=row.get("id"),
+        payload=None,
+        created_at=datetime.fromisoformat(created_at) if created_at is not None else None,
+        is_system=row.get("is_system"),
+        payload_json=payload_json,
+    )
+
 
 def add_message(
     client: SupabaseClient, session_id: int, payload: dict, is_system: bool
@@ -34,7 +117,7 @@ def add_message(
             .insert(
                 {
                     "session_id": session_id,
-                    "payload_json": json.dumps(payload),
+                    "payload_json": codec.dumps(payload),
                     "is_system": is_system,
                 }
             )
@@ -47,12 +130,7 @@ def add_message(
         logger.trace(
             f"DB {'system' if is_system else 'user'} message added to session {session_id}"
         )
-        return Message(
-            id=result.data[0]["id"],
-            payload=json.loads(result.data[0]["payload_json"]),
-            created_at=datetime.fromisoformat(result.data[0]["created_at"]),
-            is_system=result.data[0]["is_system"],
-        )
+        return message_from_row(result.data[0])
     except Exception as e:
         logger.error(
             f"DB error adding {'system' if is_system else 'user'} message to session {session_id}"
@@ -74,7 +152,7 @@ def add_multiple_messages(
                 [
                     {
                         "session_id": session_id,
-                        "payload_json": json.dumps(payload),
+                        "payload_json": codec.dumps(payload),
                         "is_system": is_system,
                     }
                     for payload in payloads
@@ -88,16 +166,7 @@ def add_multiple_messages(
             )
             return None
 
-        messages = []
-        for message in result.data:
-            messages.append(
-                Message(
-                    id=message["id"],
-                    payload=json.loads(message["payload_json"]),
-                    created_at=datetime.fromisoformat(message["created_at"]),
-                    is_system=message["is_system"],
-                )
-            )
+        messages = [message_from_row(message) for message in result.data]
 
         logger.trace(
             f"DB {'system' if is_system else 'user'} messages added to session {session_id}"
@@ -114,70 +183,26 @@ def add_multiple_messages(
 
 def duplicate_all_session_messages_and_assign_to_new_session(
     client: SupabaseClient, old_session_id: int, new_session_id: int
-) -> Optional[list[Message]]:
+) -> Optional[int]:
+    """
+    Copy the messages of a session to another one in the database (see
+    sql/001_duplicate_session.sql and sql/008_copy_session_messages_created_at.sql).
+    Returns the number of messages copied.
+    """
     try:
         logger.trace(
             f"DB duplicating all messages from session {old_session_id} to session {new_session_id}"
         )
-        result = (
-            client.table("sessions messages")
-            .select("*")
-            .eq("session_id", old_session_id)
-            .execute()
-        )
-        if len(result.data) == 0:
-            logger.trace(f"DB no messages found in session {old_session_id}")
-            return []
+        result = client.rpc(
+            "copy_session_messages",
+            {"p_old_session_id": old_session_id, "p_new_session_id": new_session_id},
+        ).execute()
 
         logger.trace(
-            f"DB {len(result.data)} messages found in session {old_session_id}"
+            f"DB {result.data} messages added to session {new_session_id}"
         )
 
-        messages = []
-        for message in result.data:
-            messages.append(
-                Message(
-                    id=message["id"],
-                    payload=json.loads(message["payload_json"]),
-                    created_at=datetime.fromisoformat(message["created_at"]),
-                    is_system=message["is_system"],
-                )
-            )
-
-        result = (
-            client.table("sessions messages")
-            .insert(
-                [
-                    {
-                        "session_id": new_session_id,
-                        "payload_json": json.dumps(message.payload),
-                        "is_system": message.is_system,
-                    }
-                    for message in messages
-                ]
-            )
-            .execute()
-        )
-        if len(result.data) == 0:
-            logger.error(f"DB no messages added to session {new_session_id}")
-            return None
-
-        logger.trace(
-            f"DB {len(result.data)} messages added to session {new_session_id}"
-        )
-
-        messages = []
-        for message in result.data:
-            messages.append(
-                Message(
-                    id=message["id"],
-                    payload=json.loads(message["payload_json"]),
-                    created_at=datetime.fromisoformat(message["created_at"]),
-                    is_system=message["is_system"],
-                )
-            )
-
-        return messages
+        return result.data
 
     except Exception as e:
         logger.error(
@@ -187,30 +212,36 @@ def duplicate_all_session_messages_and_assign_to_new_session(
         return None
 
 
-def get_messages(client: SupabaseClient, session_id: int) -> Optional[list[Message]]:
+def get_messages(
+    client: SupabaseClient,
+    session_id: int,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    columns: str = MESSAGE_COLUMNS,
+) -> Optional[list[Message]]:
+    """
+    Messages of a session in chronological order, optionally only those with
+    `after_id < id < before_id` and at most the `limit` oldest of them.
+    """
     try:
-        logger.trace(f"DB getting messages from session {session_id}")
-        result = (
-            client.table("sessions messages")
-            .select("*")
-            .eq("session_id", session_id)
-            .order("id")
-            .execute()
+        logger.trace(
+            f"DB getting messages from session {session_id} (after {after_id}, before {before_id}, limit {limit})"
         )
+        query = client.table("sessions messages").select(columns).eq("session_id", session_id)
+        if after_id is not None:
+            query = query.gt("id", after_id)
+        if before_id is not None:
+            query = query.lt("id", before_id)
+        query = query.order("id")
+        if limit is not None:
+            query = query.limit(limit)
+        result = query.execute()
         if len(result.data) == 0:
             logger.trace(f"DB no messages found in session {session_id}")
             return []
 
-        messages = []
-        for message in result.data:
-            messages.append(
-                Message(
-                    id=message["id"],
-                    payload=json.loads(message["payload_json"]),
-                    created_at=datetime.fromisoformat(message["created_at"]),
-                    is_system=message["is_system"],
-                )
-            )
+        messages = [message_from_row(message) for message in result.data]
 
         logger.trace(f"DB {len(messages)} messages found in session {session_id}")
 
@@ -219,3 +250,37 @@ def get_messages(client: SupabaseClient, session_id: int) -> Optional[list[Messa
         logger.error(f"DB error getting messages from session {session_id}")
         logger.exception(e)
         return None
+
+
+def get_last_messages(
+    client: SupabaseClient,
+    session_id: int,
+    limit: int = HISTORY_PAGE_SIZE,
+    before_id: Optional[int] = None,
+    columns: str = MESSAGE_COLUMNS,
+) -> Optional[tuple[list[Message], Optional[int]]]:
+    """
+    The `limit` newest messages of a session older than `before_id`, in chronological order,
+    and the cursor to pass as `before_id` to get the previous page, None if there is none.
+    """
+    try:
+        logger.trace(
+            f"DB getting last {limit} messages from session {session_id} (before {before_id})"
+        )
+        query = client.table("sessions messages").select(columns).eq("session_id", session_id)
+        if before_id is not None:
+            query = query.lt("id", before_id)
+        # one extra row tells whether an older page exists
+        result = query.order("id", desc=True).limit(limit + 1).execute()
+
+        rows = result.data[:limit]
+        messages = [message_from_row(message) for message in reversed(rows)]
+        cursor = messages[0].id if len(result.data) > limit else None
+
+        logger.trace(f"DB {len(messages)} last messages found in session {session_id}")
+
+        return messages, cursor
+    except Exception as e:
+        logger.error(f"DB error getting last messages from session {session_id}")
+        logger.exception(e)
+        return None
@@ -0,0 +1,349 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, UTC
+from typing import Optional
+from loguru import logger
+from supabase import Client as SupabaseClient
+
+from yourapp.sessions import update_hot_session
+from yourapp.sessions.messages import Message
+from yourapp.utils import codec
+
+
+@dataclass(slots=True, frozen=True)
+class StateChange:
+    """
+    A state to persist, encoded either whole as `snapshot_json`, or as
+    `patch_json` (its top level keys that changed) and `removed_keys`.
+    """
+
+    state: dict
+    hashes: dict[str, int]
+    snapshot_json: Optional[str] = None
+    patch_json: Optional[str] = None
+    removed_keys: Optional[list[str]] = None
+
+
+class StateTracker:
+    """
+    Tracks the persisted version of a state through the hash of each of its top
+    level values, to tell whether and how a newer version changed. States
+    changing by a few keys are persisted as patches, except for one snapshot
+    every `snapshot_every` changes or when the patch is not much smaller.
+    """
+
+    snapshot_every: int
+
+    def __init__(self, state: Optional[dict] = None, snapshot_every: int = 20):
+        self.snapshot_every = snapshot_every
+        self._hashes: Optional[dict[str, int]] = (
+            {key: hash(value) for key, value in _encode_values(state).items()}
+            if state is not None
+            else None
+        )
+        self._patches = 0
+
+    def change(self, state: dict) -> Optional[StateChange]:
+        """What to persist to get from the persisted version to `state`, None if they are the same."""
+        encoded = _encode_values(state)
+        hashes = {key: hash(value) for key, value in encoded.items()}
+        if hashes == self._hashes:
+            return None
+
+        snapshot_json = _join_values(encoded)
+        if self._hashes is None or self._patches + 1 >= self.snapshot_every:
+            return StateChange(state, hashes, snapshot_json=snapshot_json)
+
+        patch_json = _join_values(
+            {
+                key: value
+                for key, value in encoded.items()
+                if self._hashes.get(key) != hashes[key]
+            }
+        )
+        removed_keys = [key for key in self._hashes if key not in hashes]
+        if len(patch_json) * 2 > len(snapshot_json):
+            return StateChange(state, hashes, snapshot_json=snapshot_json)
+        return StateChange(state, hashes, patch_json=patch_json, removed_keys=removed_keys)
+
+    def persisted(self, change: StateChange):
+        """Make `change` the persisted version."""
+        self._hashes = change.hashes
+        self._patches = 0 if change.snapshot_json is not None else self._patches + 1
+
+
+def _encode_values(state: dict) -> dict[str, str]:
+    # keys are stringified like JSON objects do
+    return {str(key): codec.dumps(value) for key, value in state.items()}
+
+
+def _join_values(encoded: dict[str, str]) -> str:
+    return "{" + ",".join([f"{codec.dumps(key)}:{value}" for key, value in encoded.items()]) + "}"
+
+
+def persist_session_tick(
+    client: SupabaseClient,
+    session_id: int,
+    system_state: Optional[StateChange],
+    user_state: Optional[StateChange],
+    messages: list[Message],
+) -> Optional[int]:
+    """
+    Update the states (when not None) and insert the messages of a session in one
+    transaction (see sql/003_persist_session_tick_patches.sql). Returns the number of messages inserted.
+    """
+    try:
+        logger.trace(
+            f"DB persisting {len(messages)} messages{' and states' if system_state is not None or user_state is not None else ''} for session {session_id}"
+        )
+        params = {
+            "p_session_id": session_id,
+            "p_messages": [
+                {
+                    "payload_json": message.payload_json,
+                    "is_system": message.is_system,
+                    "created_at": message.created_at.isoformat(),
+                }
+                for message in messages
+            ],
+        }
+        for name, change in [("system_state", system_state), ("user_state", user_state)]:
+            if change is None:
+                continue
+            if change.snapshot_json is not None:
+                params[f"p_{name}_json"] = change.snapshot_json
+            else:
+                params[f"p_{name}_patch"] = change.patch_json
+                params[f"p_{name}_removed"] = change.removed_keys
+        result = client.rpc("persist_session_tick", params).execute()
+
+        logger.trace(f"DB session {session_id} persisted")
+        states = {
+            name: change.state
+            for name, change in [("system_state", system_state), ("user_state", user_state)]
+            if change is not None
+        }
+        # naive UTC, as the timestamps of the sessions table are read back
+        update_hot_session(
+            session_id, last_activity_at=datetime.now(UTC).replace(tzinfo=None), **states
+        )
+        return result.data
+    except Exception as e:
+        logger.error(f"DB error persisting session {session_id}")
+        logger.exception(e)
+        return None
+
+
+class SessionFlusher:
+    """
+    Flushes the writers of every session of this process when they are due: a
+    single thread waits for the next one due, and a pool of `threads` threads
+    writes them, so that the number of threads does not grow with the chats.
+    """
+
+    def __init__(self, threads: int):
+        self._condition = threading.Condition()
+        self._due: list[tuple[float, int, "SessionWriter"]] = []
+        self._order = itertools.count()
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="session-writer")
+        self._thread = threading.Thread(target=self._run, name="session-flusher", daemon=True)
+        self._thread.start()
+
+    def schedule(self, writer: "SessionWriter", due: float):
+        """Flush `writer` at `due`, a `time.monotonic` time."""
+        with self._condition:
+            heapq.heappush(self._due, (due, next(self._order), writer))
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while len(self._due) == 0:
+                    self._condition.wait()
+                due, _, writer = self._due[0]
+                now = time.monotonic()
+                if due > now:
+                    self._condition.wait(due - now)
+                    continue
+                heapq.heappop(self._due)
+            self._pool.submit(self._flush_writer, writer, due)
+
+    def _flush_writer(self, writer: "SessionWriter", due: float):
+        # nothing waits on the pool's futures, errors would go unnoticed
+        try:
+            writer._flush_due(due)
+        except Exception as e:
+            logger.error(f"session {writer.session_id} failed to flush")
+            logger.exception(e)
+            with writer._condition:
+                writer._schedule(writer.flush_interval)
+
+
+_SESSION_FLUSHER: Optional[SessionFlusher] = None
+_SESSION_FLUSHER_LOCK = threading.Lock()
+
+
+def get_session_flusher() -> SessionFlusher:
+    """
+    The flusher of every `SessionWriter`, configured on first use by
+    SESSION_WRITER_THREADS (default 4).
+    """
+    global _SESSION_FLUSHER
+    with _SESSION_FLUSHER_LOCK:
+        if _SESSION_FLUSHER is None:
+            _SESSION_FLUSHER = SessionFlusher(int(os.getenv("SESSION_WRITER_THREADS", "4")))
+        return _SESSION_FLUSHER
+
+
+class SessionWriter:
+    """
+    Write-behind persistence of a session for the chat loop.
+
+    States updates are coalesced (the last one wins) and messages are queued,
+    then both are written by the shared `SessionFlusher` in a single
+    transaction, at most `flush_interval` seconds after they were queued or as
+    soon as `max_pending_messages` are waiting. Writes happen in the order they
+    were queued, a failed write being retried before anything queued after it.
+
+    States are only written when they differ from the persisted ones, passed
+    as `system_state` and `user_state` when known, see `StateTracker`.
+    """
+
+    client: SupabaseClient
+    session_id: int
+    flush_interval: float
+    max_pending_messages: int
+
+    def __init__(
+        self,
+        client: SupabaseClient,
+        session_id: int,
+        flush_interval: float = 0.5,
+        max_pending_messages: int = 50,
+        system_state: Optional[dict] = None,
+        user_state: Optional[dict] = None,
+    ):
+        self.client = client
+        self.session_id = session_id
+        self.flush_interval = flush_interval
+        self.max_pending_messages = max_pending_messages
+
+        self._system_state_tracker = StateTracker(system_state)
+        self._user_state_tracker = StateTracker(user_state)
+
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._states: Optional[tuple[dict, dict]] = None
+        self._messages: list[Message] = []
+        self._closed = False
+        # when the flusher is to flush this writer next, None if not scheduled
+        self._due: Optional[float] = None
+
+    def update_states(self, system_state: dict, user_state: dict):
+        with self._condition:
+            self._states = (system_state, user_state)
+            self._schedule(self.flush_interval)
+
+    def add_messages(self, payloads: list[dict], is_system: bool) -> list[Message]:
+        """Queue messages and return them right away, without their database id."""
+        messages = [
+            Message(
+                id=None,
+                payload=payload,
+                created_at=datetime.now(UTC),
+                is_system=is_system,
+            )
+            for payload in payloads
+        ]
+        with self._condition:
+            self._messages += messages
+            self._schedule(
+                0.0 if len(self._messages) >= self.max_pending_messages else self.flush_interval
+            )
+        return messages
+
+    def flush(self) -> bool:
+        """Write everything queued so far. Returns False if it could not be written."""
+        return self._flush()
+
+    def close(self, retries: int = 3) -> bool:
+        """Stop flushing in the background and write everything still queued."""
+        with self._condition:
+            self._closed = True
+            self._due = None
+
+        for attempt in range(retries):
+            if self._flush():
+                return True
+            time.sleep(self.flush_interval * (attempt + 1))
+        logger.error(
+            f"session {self.session_id} lost {len(self._messages)} queued messages"
+        )
+        return False
+
+    def _has_pending(self) -> bool:
+        return self._states is not None or len(self._messages) > 0
+
+    def _schedule(self, delay: float):
+        # with self._condition held, a flush due sooner makes the later one moot
+        due = time.monotonic() + delay
+        if self._closed or (self._due is not None and self._due <= due):
+            return
+        self._due = due
+        get_session_flusher().schedule(self, due)
+
+    def _flush_due(self, due: float):
+        with self._condition:
+            if self._due != due:
+                return
+            self._due = None
+        flushed = self._flush()
+        with self._condition:
+            if not flushed or self._has_pending():
+                self._schedule(self.flush_interval)
+
+    def _flush(self) -> bool:
+        with self._flush_lock:
+            with self._condition:
+                states, messages = self._states, self._messages
+                self._states, self._messages = None, []
+            if states is None and len(messages) == 0:
+                return True
+
+            system_state, user_state = None, None
+            try:
+                if states is not None:
+                    system_state = self._system_state_tracker.change(states[0])
+                    user_state = self._user_state_tracker.change(states[1])
+            except Exception as e:
+                logger.error(f"session {self.session_id} failed to encode states")
+                logger.exception(e)
+                self._requeue(states, messages)
+                return False
+            if system_state is None and user_state is None and len(messages) == 0:
+                return True
+
+            result = persist_session_tick(
+                self.client, self.session_id, system_state, user_state, messages
+            )
+            if result is not None:
+                if system_state is not None:
+                    self._system_state_tracker.persisted(system_state)
+                if user_state is not None:
+                    self._user_state_tracker.persisted(user_state)
+                return True
+
+            self._requeue(states, messages)
+            return False
+
+    def _requeue(self, states: Optional[tuple[dict, dict]], messages: list[Message]):
+        # put it back in front of whatever was queued meanwhile
+        with self._condition:
+            if self._states is None:
+                self._states = states
+            self._messages = messages + self._messages
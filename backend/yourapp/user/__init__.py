@@ -1,9 +1,14 @@
+import os
+import threading
 from dataclasses import dataclass
 from typing import Optional
 from loguru import logger
 from supabase import Client as SupabaseClient
 from gotrue.types import UserAttributes
 
+from yourapp.utils import codec
+from yourapp.utils.ttl_cache import TTLCache, shared_cache_from_url
+
 
 @dataclass
 class UserInfos:
@@ -28,7 +33,48 @@ class UserInfos:
         )
 
 
+_USER_INFOS_CACHE: Optional[TTLCache[str, UserInfos]] = None
+_USER_INFOS_CACHE_LOCK = threading.Lock()
+
+
+def get_user_infos_cache() -> TTLCache[str, UserInfos]:
+    """
+    The cache of `get_user_infos`, configured on first use by environment variables:
+    USER_INFOS_CACHE_TTL (seconds, default 300), USER_INFOS_CACHE_SIZE (default 10000),
+    and SHARED_CACHE_URL (e.g. redis://localhost:6379/0) to share it between workers.
+    """
+    global _USER_INFOS_CACHE
+    with _USER_INFOS_CACHE_LOCK:
+        if _USER_INFOS_CACHE is None:
+            shared = shared_cache_from_url(os.getenv("SHARED_CACHE_URL"))
+            _USER_INFOS_CACHE = TTLCache(
+                max_size=int(os.getenv("USER_INFOS_CACHE_SIZE", "10000")),
+                ttl=float(os.getenv("USER_INFOS_CACHE_TTL", "300")),
+                shared=shared,
+                # other workers see invalidations once their own copy expires
+                local_ttl=5.0 if shared is not None else None,
+                namespace="user-infos",
+                dumps=codec.dumps,
+                loads=lambda data: UserInfos(**codec.loads(data)),
+            )
+        return _USER_INFOS_CACHE
+
+
 def get_user_infos(client: SupabaseClient, user_id: str) -> Optional[UserInfos]:
+    """Cached for a few minutes, see `get_user_infos_cache`. Users not onboarded yet get a NOT_FOUND UserInfos."""
+    cache = get_user_infos_cache()
+    user_infos = cache.get(user_id)
+    if user_infos is not None:
+        return user_infos
+
+    user_infos = fetch_user_infos(client, user_id)
+    # misses are not cached, they could outlive the invalidation of `onboard_user`
+    if user_infos is not None and user_infos.id != "NOT_FOUND":
+        cache.set(user_id, user_infos)
+    return user_infos
+
+
+def fetch_user_infos(client: SupabaseClient, user_id: str) -> Optional[UserInfos]:
     try:
         logger.trace(f"DB getting user infos for user {user_id}")
         result = (
@@ -67,6 +113,8 @@ def onboard_user(
             logger.error(f"DB no user onboarded for user {user_id}")
             return None
 
+        get_user_infos_cache().invalidate(user_id)
+
         user_client.auth.update_user(UserAttributes(password=new_password))
 
         logger.trace(f"DB user onboarded for user {user_id}")
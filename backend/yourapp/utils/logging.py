@@ -1,4 +1,8 @@
 import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
 from loguru import logger
 import sys
 
@@ -40,3 +44,36 @@ def setup_simple_logger(log_level: str, log_file: str = None):
             )
 
     logger.info(f"Setting LogLevel to {log_level.upper()}")
+
+
+class StageTimings:
+    """Durations of the named stages of an operation, which may run in other threads, for logs."""
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._stages: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._stages[name] = self._stages.get(name, 0.0) + time.perf_counter() - start
+
+    def timed(self, name: str, f: Callable) -> Callable:
+        """`f` timed as the stage `name`."""
+
+        def timed_f(*args, **kwargs):
+            with self.stage(name):
+                return f(*args, **kwargs)
+
+        return timed_f
+
+    def __str__(self) -> str:
+        with self._lock:
+            stages = [f"{name} {duration * 1000:.0f}ms" for name, duration in self._stages.items()]
+        stages.append(f"total {(time.perf_counter() - self._start) * 1000:.0f}ms")
+        return ", ".join(stages)
@@ -0,0 +1,196 @@
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Generic, Optional, TypeVar
+from loguru import logger
+
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class SharedCache(ABC):
+    """A cache shared by all the processes of the app, storing strings."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl: float):
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+
+class RedisSharedCache(SharedCache):
+    """Requires the optional `redis` package."""
+
+    def __init__(self, url: str, prefix: str = "yourapp:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[str]:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: str, ttl: float):
+        self.client.set(self.prefix + key, value, px=int(ttl * 1000))
+
+    def delete(self, key: str):
+        self.client.delete(self.prefix + key)
+
+
+def shared_cache_from_url(url: Optional[str]) -> Optional[SharedCache]:
+    """Build the shared cache for `url`, or return None if there is none or it is unusable."""
+    if not url:
+        return None
+    try:
+        return RedisSharedCache(url)
+    except ImportError:
+        logger.warning("shared cache configured but redis is not installed, caching in process only")
+        return None
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    shared_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.shared_hits + self.misses
+        return (self.hits + self.shared_hits) / total if total > 0 else 0.0
+
+
+class TTLCache(Generic[K, V]):
+    """
+    Thread-safe in-process LRU cache whose entries expire after `ttl` seconds,
+    optionally backed by a `SharedCache`.
+
+    With a shared cache, entries are read from it on local misses and written to
+    it on loads, and invalidations delete them from it. Other processes may
+    then keep an invalidated entry for `local_ttl` seconds, so keep it short.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        shared: Optional[SharedCache] = None,
+        local_ttl: Optional[float] = None,
+        namespace: str = "",
+        dumps: Callable[[V], str] = json.dumps,
+        loads: Callable[[str], V] = json.loads,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared = shared
+        self.local_ttl = local_ttl if local_ttl is not None else ttl
+        self.namespace = namespace
+        self.dumps = dumps
+        self.loads = loads
+        self.stats = CacheStats()
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> Optional[V]:
+        """Return the cached value for `key`, or None."""
+        found, value = self._get_local(key)
+        if found:
+            return value
+
+        if self.shared is not None:
+            found, value = self._get_shared(key)
+            if found:
+                self._set_local(key, value)
+                return value
+
+        with self._lock:
+            self.stats.misses += 1
+        return None
+
+    def get_or_load(self, key: K, load: Callable[[K], Optional[V]]) -> Optional[V]:
+        """Return the cached value for `key`, loading and caching it on a miss. None is never cached."""
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        value = load(key)
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None):
+        """Cache `value`, for `ttl` seconds if given and shorter than the cache's own."""
+        self._set_local(key, value, ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(
+                    self._shared_key(key),
+                    self.dumps(value),
+                    min(ttl, self.ttl) if ttl is not None else self.ttl,
+                )
+            except Exception as e:
+                logger.warning(f"shared cache error setting {self._shared_key(key)}: {e}")
+
+    def invalidate(self, key: K) -> Optional[V]:
+        """Forget `key`, returning the value this process had cached for it if any."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if self.shared is not None:
+            try:
+                self.shared.delete(self._shared_key(key))
+            except Exception as e:
+                logger.warning(f"shared cache error deleting {self._shared_key(key)}: {e}")
+        return entry[1] if entry is not None else None
+
+    def clear(self):
+        """Empty the local cache only."""
+        with self._lock:
+            self._entries.clear()
+
+    def _get_local(self, key: K) -> tuple[bool, Optional[V]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return True, value
+
+    def _get_shared(self, key: K) -> tuple[bool, Optional[V]]:
+        try:
+            data = self.shared.get(self._shared_key(key))
+        except Exception as e:
+            logger.warning(f"shared cache error getting {self._shared_key(key)}: {e}")
+            return False, None
+        if data is None:
+            return False, None
+        with self._lock:
+            self.stats.shared_hits += 1
+        return True, self.loads(data)
+
+    def _set_local(self, key: K, value: V, ttl: Optional[float] = None):
+        ttl = min(ttl, self.local_ttl) if ttl is not None else self.local_ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def _shared_key(self, key: Any) -> str:
+        return f"{self.namespace}:{key}"
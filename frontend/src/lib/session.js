@@ -1,4 +1,4 @@
-import { writable } from "svelte/store";
+import { get, writable } from "svelte/store";
 import { useAccessToken } from "./accessToken";
 import { env } from '$env/dynamic/public';
 import { dateObjectFromUTC } from '$lib/utils';
@@ -6,31 +6,48 @@ import { dateObjectFromUTC } from '$lib/utils';
 
 export function useSessions() {
     let sessions = writable([]);
+    // where the next page of older sessions starts, null if there is none
+    let sessionsCursor = writable(null);
     let accessToken = useAccessToken();
     let token = '';
 
+    async function fetchSessionSummaries(cursor) {
+        // summaries leave the sessions' states out, the sidebar only shows titles
+        let url = `${env.PUBLIC_API_URL}/sessions?token=${token}&summary=true`;
+        if (cursor !== null) {
+            url += `&before=${encodeURIComponent(cursor.before)}&before_id=${cursor.before_id}`;
+        }
+        const response = await fetch(url, { method: 'GET' });
+        if (!response.ok) return null;
+        const data = await response.json();
+        data.sessions.forEach((session) => {
+            session.last_activity_at = dateObjectFromUTC(session.last_activity_at);
+        });
+        return data;
+    }
+
     async function refreshSessions() {
         try {
-            const response = await fetch(`${env.PUBLIC_API_URL}/sessions?token=${token}`, {
-            method: 'GET'
-            });
-            if (response.ok) {
-            const data = await response.json();
-            const list = data.sessions;
-            list.forEach((session) => {
-                session.created_at = dateObjectFromUTC(session.created_at);
-                session.last_activity_at = dateObjectFromUTC(session.last_activity_at);
-
-                console.log(session.created_at)
-            });
-            list.sort((a, b) => b.last_activity_at - a.last_activity_at);
-            sessions.set(data.sessions);
-            } else {
-            sessions.set([]);
-            }
+            const data = await fetchSessionSummaries(null);
+            sessions.set(data?.sessions ?? []);
+            sessionsCursor.set(data?.cursor ?? null);
         } catch (error) {
             console.error('Error fetching sessions:', error);
             sessions.set([]);
+            sessionsCursor.set(null);
+        }
+    }
+
+    async function loadOlderSessions() {
+        const cursor = get(sessionsCursor);
+        if (cursor === null || !token) return;
+        try {
+            const data = await fetchSessionSummaries(cursor);
+            if (data === null) return;
+            sessions.update((inner) => inner.concat(data.sessions));
+            sessionsCursor.set(data.cursor);
+        } catch (error) {
+            console.error('Error fetching older sessions:', error);
         }
     }
 
@@ -40,15 +57,30 @@ export function useSessions() {
         refreshSessions();
     });
 
-    return { sessions, refreshSessions };
+    return { sessions, sessionsCursor, refreshSessions, loadOlderSessions };
 }
 
-export function usePayloads(sessionId, onSessionCreated, onPayloadReceived) {
+// close code of chats the server parked while they waited for the user
+const IDLE_CLOSE_CODE = 4000;
+
+export function usePayloads(sessionId, onSessionCreated, onPayloadReceived, onOlderPayloadsReceived) {
     let accessToken = useAccessToken();
+    let token = '';
+    let historyCursor = writable(null);
+    // session the server serves: the requested one, the one it created or a copy of it
+    let servedSessionId = null;
     let state = writable('closed');
     let sendPayload = writable((_) => {});
     let ws = writable(null);
     let finished = false;
+    // parked chats are resumed by reconnecting, then sending what the user sent meanwhile
+    let resuming = false;
+    let pendingPayload = null;
+
+    function sessionUrl() {
+        const id = servedSessionId ?? (`${sessionId}`.startsWith('new') ? '-1' : sessionId);
+        return `${env.PUBLIC_WS_URL}/chat/${id}?token=${token}`;
+    }
 
     function connect(url) {
         ws.update((value) => {
@@ -76,7 +108,8 @@ export function usePayloads(sessionId, onSessionCreated, onPayloadReceived) {
     
     accessToken.subscribe((value) => {
         if (!value) return;
-        connect(`${env.PUBLIC_WS_URL}/chat/${`${sessionId}`.startsWith('new') ? '-1' : sessionId}?token=${value}`);
+        token = value;
+        connect(sessionUrl());
     });
 
     ws.subscribe((value) => {
@@ -87,7 +120,13 @@ export function usePayloads(sessionId, onSessionCreated, onPayloadReceived) {
         value.socket.onopen = () => {
             console.log('Connected to YOUR APP');
         };
-        value.socket.onclose = () => {
+        value.socket.onclose = (event) => {
+            if (event.code === IDLE_CLOSE_CODE && !finished) {
+                console.log('Parked by the server');
+                ws.set(null);
+                park();
+                return;
+            }
             state.set('closed');
             if (!finished) {
                 console.log('Connection closed forcibly');
@@ -98,27 +137,72 @@ export function usePayloads(sessionId, onSessionCreated, onPayloadReceived) {
         value.socket.onmessage = (event) => {
             const data = JSON.parse(event.data);
             console.log('Received message', data);
-            if (data.payload.type === 'state' && data.payload.state === 'closed') {
-                close();
-            }
-            if (data.payload.type === 'state' && data.payload.state === 'opened') {
-                open(value.socket);
+            if (data.payload.type === 'history' && resuming) {
+                // already shown, only tells whether the session waits for the user
+                servedSessionId = data.payload.session_id;
+                const last = data.payload.messages[data.payload.messages.length - 1];
+                if (last && last.payload.type === 'state' && last.payload.state === 'opened') {
+                    open(value.socket);
+                }
+                return;
             }
-            if (data.payload.type === 'session_created') {
-                sessionId = data.payload.id;
-                onSessionCreated(data.payload.id);
+            if (data.payload.type === 'history') {
+                // newest page of the session's history, older pages come from loadOlderPayloads
+                servedSessionId = data.payload.session_id;
+                historyCursor.set(data.payload.cursor);
+                data.payload.messages.forEach((message) => handleMessage(value.socket, message));
+                return;
             }
-            if (data.payload.type === 'end') {
-                finished = true
-                value.socket.close();
-                close();
-            }
-
-            onPayloadReceived(data.payload, data.is_system, data.created_at);
+            handleMessage(value.socket, data);
         };
     });
 
+    function handleMessage(socket, data) {
+        if (data.payload.type === 'state' && data.payload.state === 'closed') {
+            close();
+        }
+        if (data.payload.type === 'state' && data.payload.state === 'opened') {
+            open(socket);
+        }
+        if (data.payload.type === 'session_created') {
+            sessionId = data.payload.id;
+            servedSessionId = data.payload.id;
+            onSessionCreated(data.payload.id);
+        }
+        if (data.payload.type === 'end') {
+            finished = true
+            socket.close();
+            close();
+        }
+
+        onPayloadReceived(data.payload, data.is_system, data.created_at);
+    }
+
+    async function loadOlderPayloads() {
+        const cursor = get(historyCursor);
+        if (cursor === null || !token) return;
+        try {
+            const response = await fetch(
+                `${env.PUBLIC_API_URL}/sessions/${servedSessionId}/messages?token=${token}&before_id=${cursor}`,
+                { method: 'GET' }
+            );
+            if (!response.ok) return;
+            const data = await response.json();
+            historyCursor.set(data.cursor);
+            onOlderPayloadsReceived(data.messages);
+        } catch (error) {
+            console.error('Error fetching older payloads:', error);
+        }
+    }
+
     function open(socket) {
+        resuming = false;
+        if (pendingPayload) {
+            console.log('Resuming with payload', pendingPayload);
+            socket.send(JSON.stringify(pendingPayload));
+            pendingPayload = null;
+            return;
+        }
         state.set('opened');
         console.log('Opened');
         sendPayload.set((payload) => {
@@ -133,9 +217,23 @@ export function usePayloads(sessionId, onSessionCreated, onPayloadReceived) {
         sendPayload.set((_) => {});
     }
 
+    function park() {
+        // the server only parks chats waiting for the user, who can keep typing
+        resuming = true;
+        state.set('opened');
+        sendPayload.set((payload) => {
+            console.log('Resuming parked session', servedSessionId);
+            pendingPayload = payload;
+            state.set('closed');
+            connect(sessionUrl());
+        });
+    }
+
     return {
         state,
         sendPayload,
-        disconnect
+        disconnect,
+        historyCursor,
+        loadOlderPayloads
     };
 }
\ No newline at end of file